@@ -9,6 +9,7 @@
 import yaml
 yaml.warnings({'YAMLLoadWarning': False})
 import time
+import os
 import numpy as np
 from numba import boolean, int32, int64, float64, double, njit, prange, typeof
 import itertools
@@ -28,6 +29,7 @@ import funs
 import transitions
 import solution
 import setup
+import storage
 
 ############
 # 2. model #
@@ -40,12 +42,16 @@ class RetirementClass(ModelClass):
     #########
     
     def __init__(self,name='baseline',couple=False,year=2008,
-                 load=False,single_kwargs={},**kwargs):
+                 load=False,cache=None,single_kwargs={},**kwargs):
 
         # a. store args
         self.name = name 
         self.couple = couple
         self.year = year
+        self.cache = cache  # directory with precomputed survival and income tables (see _precompute)
+        self.buffers = {}   # solution and simulation arrays reused across calls (see _buffer)
+        self.precomputed = None     # snapshot of par from the last recompute (see setup.stale)
+        self.rng_state = None       # state of numpy's global generator before the income shocks are drawn
 
         # b. subclasses 
         if couple:
@@ -66,7 +72,8 @@ class RetirementClass(ModelClass):
             single_kwargs['g_adjust'] = self.par.g_adjust
             single_kwargs['priv_pension_female'] = self.par.priv_pension_female
             single_kwargs['priv_pension_male'] = self.par.priv_pension_male            
-            self.Single = RetirementClass(name=name+'_single',year=year,**single_kwargs)
+            single_kwargs.setdefault('sol_tables',self.par.sol_tables)
+            self.Single = RetirementClass(name=name+'_single',year=year,cache=cache,**single_kwargs)
     
     def pars(self,**kwargs):
         """ define baseline values and update with user choices
@@ -82,6 +89,7 @@ class RetirementClass(ModelClass):
         # misc
         self.par.denom = 1e5       # all monetary variables are denominated in 100.000 DKR
         self.par.tol = 1e-6
+        self.par.sol_tables = False    # store retirement probabilities on the grid in the solution (interpolated in the simulation)
 
         # time parameters
         self.par.start_T = 57                                   # start age
@@ -91,6 +99,9 @@ class RetirementClass(ModelClass):
 
         # simulation
         self.par.sim_seed = 2019
+        self.par.sim_rng = 0                # 0: numpy's global generator (published estimates), 1: counter based streams (independent of simN, chunks and threads)
+        self.par.sim_draws = 0              # 0: iid, 1: antithetic pairs, 2: scrambled Sobol (both within the state cells)
+        self.par.sim_alloc = 0              # agents per state cell, 0: proportional to the population, 1: equal, 2: Neyman (weighted by sim.w)
         self.par.simN = int(1e5)            
 
         # savings
@@ -174,18 +185,72 @@ class RetirementClass(ModelClass):
         self.recompute()
 
     def recompute(self):
-        """ recompute precomputations if institutional variables have been changed """ 
-        # 1. translate to model time and setup grids        
-        setup.model_time(self.par)
-        setup.grids(self.par)
-        
-        # 2. precompute and initialize simulation (sensitive to the order)
-        transitions.precompute_survival(self.par)
-        setup.init_sim(self.par,self.sim)
-        if self.couple:
-            transitions.precompute_inc_couple(self.par)
-        else:
-            transitions.precompute_inc_single(self.par)
+        """ recompute the precomputations that depend on fields in par that have changed since the last call (see setup.PRECOMPUTE) """
+
+        # 1. stale precomputations
+        stages = setup.stale(self.par,self.precomputed)
+
+        # 2. translate to model time and setup grids
+        if 'time' in stages:
+            setup.model_time(self.par)
+        if 'grids' in stages:
+            setup.grids(self.par)
+
+        # 3. precompute and initialize simulation (sensitive to the order)
+        if 'survival' in stages:
+            self._precompute('survival',transitions.precompute_survival)
+        if 'sim' in stages:
+            self.rng_state = setup.init_sim_states(self.par,self.sim)
+        if 'labor' in stages:
+            setup.init_sim_shocks(self.par,self.sim,self.rng_state)
+        if 'income' in stages:
+            if self.couple:
+                self._precompute('income',transitions.precompute_inc_couple)
+            else:
+                self._precompute('income',transitions.precompute_inc_single)
+
+        # 4. snapshot
+        self.precomputed = setup.snapshot(self.par)
+
+    def _precompute(self,stage,fun):
+        """ run the precomputation fun(par) of stage or load its tables from the cache directory
+        (the files are named by a hash of the fields in par that the tables are a function of, see setup.cache_key) """
+
+        if self.cache is None:
+            fun(self.par)
+            return
+
+        path = os.path.join(self.cache,stage+'_'+setup.cache_key(self.par,stage)+'.npz')
+        if not storage.load_tables(path,self.par):
+            fun(self.par)
+            storage.save_tables(path,self.par,setup.TABLES[stage])
+
+    ###########
+    # buffers #
+    ###########
+    def _buffer(self,key,shape,dtype=np.float64,fill=np.nan,tag=None):
+        """ array reused across calls to solve and simulate (only allocated if the shape or type changes)
+
+        Args:
+            key (str): name of the buffer
+            shape (tuple): shape of the array
+            dtype (numpy.dtype): type of the array
+            fill (float): initial value
+            tag (tuple): if given and unchanged since the last call the array is not reset to fill
+                         (the solver overwrites every reachable cell, so the solution is only reset 
+                         if the reachable cells change)
+
+        Returns:
+            array of shape and dtype (arrays from earlier calls are overwritten, so copy them to keep them)
+        """
+
+        x,tag_old = self.buffers.get(key,(None,None))
+        if x is None or x.shape != shape or x.dtype != dtype:
+            x = np.full(shape,fill,dtype=dtype)
+        elif tag is None or tag != tag_old:
+            x.fill(fill)
+        self.buffers[key] = (x,tag)
+        return x
 
     #########
     # solve #
@@ -202,27 +267,42 @@ class RetirementClass(ModelClass):
         Na = self.par.Na                # number of points in grid           
         NRA = 3                         # number of retirement status
 
+        # reachable cells of the solution (reset if they change)
+        tag = (T,self.par.Tr,self.par.T_oap,self.par.T_erp,self.par.T_two_year)
+
         if self.couple:
             NAD = len(self.par.AD)      # number of age differences               
             ND = 4                      # number of choices
 
             # solution
-            self.sol.c = np.nan*np.zeros((T,NAD,NST,NST,NRA,NRA,ND,Na))   
+            self.sol.c = self._buffer('c',(T,NAD,NST,NST,NRA,NRA,ND,Na),tag=tag)   
             self.sol.m = self.par.grid_a    # common grid
-            self.sol.v = np.nan*np.zeros((T,NAD,NST,NST,NRA,NRA,ND,Na))        
+            self.sol.v = self._buffer('v',(T,NAD,NST,NST,NRA,NRA,ND,Na),tag=tag)        
+
+            # retirement probabilities (husband and wife if both work, husband if only he works and wife if only she works)
+            if self.par.sol_tables:
+                self.sol.prob = self._buffer('prob',(T,NAD,NST,NST,NRA,NRA,4,Na),tag=tag)
+            else:
+                self.sol.prob = np.zeros((0,)*8)
 
         else:
             NMA = len(self.par.MA)      # number of gender
             ND = 2                      # number of choices
 
             # solution
-            self.sol.c = np.nan*np.zeros((T,NMA,NST,NRA,ND,Na))   
+            self.sol.c = self._buffer('c',(T,NMA,NST,NRA,ND,Na),tag=tag)   
             self.sol.m = self.par.grid_a    # common grid
-            self.sol.v = np.nan*np.zeros((T,NMA,NST,NRA,ND,Na))     
+            self.sol.v = self._buffer('v',(T,NMA,NST,NRA,ND,Na),tag=tag)     
+
+            # retirement probabilities
+            if self.par.sol_tables:
+                self.sol.prob = self._buffer('prob',(T,NMA,NST,NRA,Na),tag=tag)
+            else:
+                self.sol.prob = np.zeros((0,)*5)
 
             # post decision
-            self.sol.avg_marg_u_plus = np.nan*np.zeros((T,NMA,NST,NRA,ND,Na))
-            self.sol.v_plus_raw = np.nan*np.zeros((T,NMA,NST,NRA,ND,Na)) 
+            self.sol.avg_marg_u_plus = self._buffer('avg_marg_u_plus',(T,NMA,NST,NRA,ND,Na),tag=tag)
+            self.sol.v_plus_raw = self._buffer('v_plus_raw',(T,NMA,NST,NRA,ND,Na),tag=tag) 
 
     def solve(self,recompute=False):
         """ solve the model """
@@ -237,6 +317,12 @@ class RetirementClass(ModelClass):
             solution.solve(self.Single.sol,self.Single.par)
             solution.solve_c(self.sol,self.Single.sol,self.par)
 
+            # retirement probabilities on the grid
+            if self.Single.par.sol_tables:
+                solution.tables(self.Single.sol,self.Single.par)
+            if self.par.sol_tables:
+                solution.tables_c(self.sol,self.par)
+
         else:
 
             # allocate solution
@@ -244,44 +330,69 @@ class RetirementClass(ModelClass):
 
             # solve model
             solution.solve(self.sol,self.par)
+
+            # retirement probabilities on the grid
+            if self.par.sol_tables:
+                solution.tables(self.sol,self.par)
         
     ############
     # simulate #
     ############
-    def _simulate_prep(self,accuracy,tax):
-        """ allocate memory for simulation """
+    def _simulate_prep(self,accuracy,tax,widow=False,scratch=None,outputs=None):
+        """ allocate memory for simulation (panels are memory mapped files in the scratch directory if given, 
+        panels which are not in outputs only keep the last two periods and euler and GovS are only allocated if in outputs) """
+
+        # panels in memory (reused across calls) or on disk
+        def panel(var,shape,dtype,fill):
+            if outputs is not None and var not in outputs:
+                return self._buffer('sim_'+var,(shape[0],2)+shape[2:],dtype,fill)    # last two periods (see simulate.tcol)
+            elif scratch is None:
+                return self._buffer('sim_'+var,shape,dtype,fill)
+            else:
+                return storage.memmap(scratch,self.name+'_'+var,shape,dtype,fill)
+
+        # panels which are only computed if requested
+        def optional(var,shape):
+            if outputs is not None and var not in outputs:
+                return np.zeros((shape[0],0))
+            else:
+                return panel(var,shape,np.float64,np.nan)
+
+        simN = self.par.simN
+        simT = self.par.simT
 
         if self.couple:
 
             extend = self.par.ad_min + self.par.ad_max
 
             # solution
-            self.sim.c = np.nan*np.zeros((self.par.simN,self.par.simT))
-            self.sim.a = np.nan*np.zeros((self.par.simN,self.par.simT))
-            self.sim.d = np.nan*np.zeros((self.par.simN,self.par.simT+extend,2))
+            self.sim.c = panel('c',(simN,simT),np.float64,np.nan)
+            self.sim.a = panel('a',(simN,simT),np.float64,np.nan)
+            self.sim.d = panel('d',(simN,simT+extend,2),np.int8,-1)
 
             # misc
-            self.sim.probs = np.nan*np.zeros((self.par.simN,self.par.simT+extend,2))  
-            self.sim.RA = 2*np.ones((self.par.simN,2),dtype=int)
-            self.sim.euler = np.nan*np.zeros((self.par.simN,self.par.simT-1))
-            self.sim.GovS = np.nan*np.zeros((self.par.simN,self.par.simT))            
+            self.sim.probs = panel('probs',(simN,simT+extend,2),np.float32,np.nan)
+            self.sim.RA = self._buffer('sim_RA',(simN,2),np.uint8,2)
+            self.sim.euler = optional('euler',(simN,simT-1))
+            self.sim.GovS = optional('GovS',(simN,simT))
 
             # booleans
             self.sim.accuracy = accuracy
             self.sim.tax = tax
+            self.sim.widow = widow
 
         else:
 
             # solution
-            self.sim.c = np.nan*np.zeros((self.par.simN,self.par.simT))
-            self.sim.a = np.nan*np.zeros((self.par.simN,self.par.simT))
-            self.sim.d = np.nan*np.zeros((self.par.simN,self.par.simT))
+            self.sim.c = panel('c',(simN,simT),np.float64,np.nan)
+            self.sim.a = panel('a',(simN,simT),np.float64,np.nan)
+            self.sim.d = panel('d',(simN,simT),np.int8,-1)
 
             # misc
-            self.sim.probs = np.nan*np.zeros((self.par.simN,self.par.simT))  
-            self.sim.RA = 2*np.ones((self.par.simN),dtype=int)
-            self.sim.euler = np.nan*np.zeros((self.par.simN,self.par.simT-1))
-            self.sim.GovS = np.nan*np.zeros((self.par.simN,self.par.simT))
+            self.sim.probs = panel('probs',(simN,simT),np.float32,np.nan)
+            self.sim.RA = self._buffer('sim_RA',(simN,),np.uint8,2)
+            self.sim.euler = optional('euler',(simN,simT-1))
+            self.sim.GovS = optional('GovS',(simN,simT))
 
             # booleans
             self.sim.accuracy = accuracy
@@ -290,14 +401,33 @@ class RetirementClass(ModelClass):
             # initialize d
             self.sim.d[:,0] = 1
 
-    def simulate(self,accuracy=False,tax=False):
-        """ simulate model """
+        # wealth (initial wealth is set in setup.init_sim)
+        self.sim.m = panel('m',(simN,simT),np.float64,np.nan)
+        self.sim.m[:,0] = self.sim.m_init
+
+    def simulate(self,accuracy=False,tax=False,widow=False,store=None,scratch=None,outputs=None):
+        """ simulate model (optionally also the surviving spouses in couples, write the panels to the parquet file store
+        and keep the panels in memory mapped files in the directory scratch instead of in memory) 
+        
+        outputs is the panels to keep (c, m, a, d, probs, GovS and euler), e.g. {'probs','d'} for the moments. 
+        The rest are not stored and GovS and euler are not computed (all are kept if None). 
+        """
+
+        # tax and accuracy are outputs
+        if outputs is not None:
+            outputs = set(outputs)
+            tax = tax or 'GovS' in outputs
+            accuracy = accuracy or 'euler' in outputs
+            if tax:
+                outputs.add('GovS')
+            if accuracy:
+                outputs.add('euler')
 
         if self.couple:
 
             # allocate memory
-            self.Single._simulate_prep(accuracy,tax)
-            self._simulate_prep(False,tax)
+            self.Single._simulate_prep(accuracy,tax,scratch=scratch,outputs=outputs)
+            self._simulate_prep(False,tax,widow,scratch,outputs)
                         
             # simulate model          
             simulate.lifecycle(self.Single.sim,self.Single.sol,self.Single.par)
@@ -306,10 +436,14 @@ class RetirementClass(ModelClass):
         else:
 
             # allocate memory
-            self._simulate_prep(accuracy,tax)
+            self._simulate_prep(accuracy,tax,scratch=scratch,outputs=outputs)
 
             # simulate model
             simulate.lifecycle(self.sim,self.sol,self.par)
+
+        # write panels to disk
+        if store is not None:
+            storage.save(self,store)
     
 
 # Single = RetirementClass()
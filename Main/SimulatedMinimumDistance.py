@@ -7,19 +7,27 @@
 import numpy as np
 import time
 import scipy as sci
-from scipy.optimize import minimize
+from scipy.optimize import minimize, OptimizeResult
 import pickle
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import itertools
+from collections import OrderedDict
 import warnings
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d.axes3d import Axes3D
 
 # local modules
 import transitions
+import setup
+import funs
+
+# panels used by MomFun (the rest are not stored in the simulation)
+MOM_OUTPUTS = ('probs','d')
 
 # TODO: 
 # 1) add a saving-module?:
-# 2) multistart-loop?
 class SimulatedMinimumDistance():
     ''' 
     This class performs simulated minimum distance (self) estimation.
@@ -28,10 +36,11 @@ class SimulatedMinimumDistance():
              Properties of model should be contained in model.par
     - mom_data: np.array (1d) of moments in the data to be used for estimation
     - mom_fun: function used to calculate moments in simulated data. Should return a 1d np.array
+    - outputs: simulated panels used by mom_fun (None is all)
     
     '''    
 
-    def __init__(self,model,mom_data,mom_fun,recompute=False,bounds=None,name='baseline',method='nelder-mead',est_par=[],par_save={},options={'disp': False},print_iter=[False,1],save=False,**kwargs): # called when created
+    def __init__(self,model,mom_data,mom_fun,recompute=False,bounds=None,name='baseline',method='nelder-mead',est_par=[],par_save={},options={'disp': False},print_iter=[False,1],save=False,outputs=MOM_OUTPUTS,memo=1000,memo_decimals=10,**kwargs): # called when created
         
         # settings for model
         self.model = model
@@ -39,6 +48,7 @@ class SimulatedMinimumDistance():
         self.mom_fun = mom_fun
         self.recompute = recompute
         self.name = name
+        self.outputs = outputs
 
         # settings for estimation
         self.bounds = bounds
@@ -54,7 +64,24 @@ class SimulatedMinimumDistance():
         self.iter = 0
         self.time = {self.iter: time.time()}
 
-    def obj_fun(self,theta,W,*args):
+        # cache of gradients (see jacobian)
+        self.jac_cache = None
+
+        # memo of simulated moments (see obj_fun)
+        self.memo = OrderedDict()
+        self.memo_size = memo
+        self.memo_decimals = memo_decimals
+        self.memo_stats = {'hits': 0, 'misses': 0}
+        self.memo_hit = False
+
+    def obj_fun(self,theta,W,*args,memo=True):
+        """ objective function (data - sim)'*W*(data - sim) at theta
+
+        The simulated moments of the last self.memo_size evaluations are kept in self.memo, keyed by theta (rounded to 
+        self.memo_decimals), est_par, the other fields in par (incl. the seed), recompute, outputs, mom_fun and args. 
+        On a hit the parameters are updated, but the model is not solved and simulated again (so model.sol and model.sim
+        are from an earlier evaluation). Hits and misses are counted in self.memo_stats. memo=False always evaluates.
+        """
         
         # print parameters
         if self.print_iter[0]:
@@ -86,14 +113,35 @@ class SimulatedMinimumDistance():
                 idx = self.est_par.index('phi_0_female')
                 setattr(self.model.par,'phi_0_male',theta[idx])
 
-            # 2. solve model with current parameters
-            self.model.solve(recompute=self.recompute)
-
-            # 3. simulate data from the model and calculate moments [have this as a complete function, used for standard errors]
-            self.model.simulate()
-            self.mom_sim = self.mom_fun(self.model,*args)
-
-            # 4. calculate objective function and return it
+            # 2. look up the moments
+            key = None
+            self.memo_hit = False
+            if memo and self.memo_size > 0:
+                key = self.memo_key(theta,args)
+                if key in self.memo:
+                    self.memo.move_to_end(key)
+                    self.memo_stats['hits'] += 1
+                    self.memo_hit = True
+                    self.mom_sim = np.copy(self.memo[key])
+                else:
+                    self.memo_stats['misses'] += 1
+
+            if not self.memo_hit:
+
+                # 3. solve model with current parameters
+                self.model.solve(recompute=self.recompute)
+
+                # 4. simulate data from the model and calculate moments [have this as a complete function, used for standard errors]
+                self.model.simulate(outputs=self.outputs)
+                self.mom_sim = self.mom_fun(self.model,*args)
+
+                # store
+                if key is not None:
+                    self.memo[key] = np.copy(self.mom_sim)
+                    if len(self.memo) > self.memo_size:
+                        self.memo.popitem(last=False)
+
+            # 5. calculate objective function and return it
             diff = self.mom_data - self.mom_sim
             self.obj  = ((np.transpose(diff) @ W) @ diff)
 
@@ -111,56 +159,182 @@ class SimulatedMinimumDistance():
         # return
         return self.obj 
 
+    def memo_key(self,theta,args=()):
+        """ key of the moments at theta in self.memo (the parameters must be set in model.par) """
+
+        h = hashlib.sha1()
+        hash_par(h,self.model,self.est_par)
+        h.update(repr((list(self.est_par),[round(float(val),self.memo_decimals) for val in theta],self.recompute,
+                       self.outputs,getattr(self.mom_fun,'__name__',''),args)).encode())
+        return h.hexdigest()
+
     def estimate(self,theta0,W,*args):
         # TODO: consider multistart-loop with several algortihms - that could alternatively be hard-coded outside
         assert(len(W[0])==len(self.mom_data)) # check dimensions of W and mom_data
 
         # estimate
-        self.est_out = minimize(self.obj_fun, theta0, (W, *args), bounds=self.bounds, method=self.method,options=self.options)
+        if self.method == 'lm':
+            self.est_out = self.levenberg_marquardt(theta0,W,*args)
+        else:
+            self.est_out = minimize(self.obj_fun, theta0, (W, *args), bounds=self.bounds, method=self.method,options=self.options)
 
         # return output
         self.est = self.est_out.x
         self.W = W     
-    
-    def MultiStart(self,theta0,weight,options={'print': True, 'time': 'min'}):
+
+    def levenberg_marquardt(self,theta0,W,*args):
+        """ Levenberg-Marquardt on the weighted residuals r = chol(W)'(mom_data - mom_sim), so r'r is the objective 
+        (used by estimate if method='lm')
+
+        Args:
+            theta0 (numpy.ndarray): starting values
+            W (numpy.ndarray): weighting matrix (positive definite)
+
+        Options (self.options):
+            maxiter (int): maximum number of iterations (each with a Jacobian)
+            lam (float): initial damping
+            xatol (float): converged if the largest change in the parameters is below xatol
+            ftol (float): converged if the objective falls by less than ftol relative to its value
+            gtol (float): converged if the largest element of the gradient of the objective is below gtol
+            step (float): relative step size in the Jacobian
+            workers, threads, context: evaluation of the Jacobian (see jacobian)
+            disp (bool): print each iteration
+
+        Returns:
+            res (scipy.optimize.OptimizeResult): x, fun, success, message, nit, nfev, njev, grad and history
+                                                 (obj, lam, change in the parameters and gradient in each iteration)
+
+        The Jacobian uses the same draws as the objective (common random numbers), so the steps are not
+        distorted by simulation noise. Steps are clipped to self.bounds.
+        """
+
+        opt = {'maxiter': 50, 'lam': 1.0e-3, 'xatol': 1.0e-4, 'ftol': 1.0e-6, 'gtol': 1.0e-8, 'step': 1.0e-4,
+               'workers': 1, 'threads': 1, 'context': None, 'disp': False, **self.options}
+
+        # a. residuals
+        L = np.linalg.cholesky(W) # W = L L'
+        def residuals(theta):
+            obj = self.obj_fun(theta,W,*args)
+            if not np.isfinite(obj):
+                return obj,None
+            return obj,L.T @ (self.mom_data - self.mom_sim)
+
+        # b. bounds
+        lower = np.full(len(theta0),-np.inf)
+        upper = np.full(len(theta0),np.inf)
+        if self.bounds is not None:
+            for i,(lo,hi) in enumerate(self.bounds):
+                lower[i] = -np.inf if lo is None else lo
+                upper[i] = np.inf if hi is None else hi
+
+        # c. iterate
+        theta = np.clip(np.array(theta0,dtype=float),lower,upper)
+        obj,r = residuals(theta)
+        if r is None:
+            raise ValueError('objective function is not finite at the starting values')
+        nfev = 1
+        njev = 0
+        at_theta = True
+        lam = opt['lam']
+        history = []
+        success = False
+        message = 'maximum number of iterations reached'
+        for it in range(opt['maxiter']):
+
+            # i. Jacobian of the residuals (grad is minus the Jacobian of the simulated moments)
+            grad,_,info = self.jacobian(theta,W,None,opt['step'],*args,workers=opt['workers'],threads=opt['threads'],
+                                        context=opt['context'],cache=False)
+            nfev += info['nfev']
+            njev += 1
+            at_theta = False
+            J = L.T @ grad
+            g = 2.0*(J.T @ r) # gradient of the objective
+            A = J.T @ J
+            if np.max(np.abs(g)) < opt['gtol']:
+                success = True
+                message = 'gradient below gtol'
+                break
+
+            # ii. damped steps until the objective falls
+            D = np.diag(np.fmax(np.diag(A),1.0e-12))
+            while True:
+                delta = np.linalg.solve(A + lam*D, -0.5*g)
+                theta_new = np.clip(theta + delta,lower,upper)
+                dx = np.max(np.abs(theta_new - theta))
+                obj_new,r_new = residuals(theta_new)
+                nfev += 1
+                at_theta = False
+                if obj_new < obj or dx < opt['xatol'] or lam > 1.0e10:
+                    break
+                lam *= 10.0
+
+            # iii. accept or stop
+            history.append({'obj': obj, 'lam': lam, 'dx': dx, 'grad': g})
+            if opt['disp']:
+                print('iteration:', it+1, '|', 'obj:', obj_new, '|', 'lam:', lam, '|', 'dx:', dx)
+            if not obj_new < obj:
+                success = dx < opt['xatol']
+                message = 'change in the parameters below xatol' if success else 'no decrease in the objective'
+                break
+            df = obj - obj_new
+            theta,obj,r = theta_new,obj_new,r_new
+            at_theta = True
+            lam = max(lam/10.0,1.0e-10)
+            if dx < opt['xatol'] or df < opt['ftol']*obj:
+                success = True
+                message = 'change in the parameters below xatol' if dx < opt['xatol'] else 'relative change in the objective below ftol'
+                break
+
+        # d. model at the estimate (the last evaluation may be a rejected step, the Jacobian or from the memo)
+        if not at_theta or self.memo_hit:
+            self.obj_fun(theta,W,*args,memo=False)
+            nfev += 1
+
+        return OptimizeResult(x=theta,fun=obj,success=success,message=message,nit=len(history),nfev=nfev,
+                              njev=njev,grad=g,history=history)
+
+    def MultiStart(self,theta0,weight,options={'print': True, 'time': 'min'},workers=1,threads=1,context=None):
+        """ estimate from each starting value in theta0 and refine the best one
+
+        Args:
+            theta0 (list): starting values
+            weight (numpy.ndarray): weighting matrix
+            options (dict): print and time unit of the prints ('sec', 'min' or 'hours')
+            workers (int): number of worker processes for the starting values (1 runs them here one after another)
+            threads (int): numba threads in each worker
+            context (str): multiprocessing start method (spawn if None, see pool)
+
+        The results of each start are stored in self.starts (in the order they finish) and the final refinement
+        from the best start is run here.
+        """
             
         # time
         tic_total = time.time()
-            
-        # preallocate
-        theta = np.nan*np.zeros(np.array(theta0).shape)
-        obj = np.nan*np.zeros(len(theta0))
 
         # options
         self.options['xatol'] = 0.001
         self.options['fatol'] = 0.001        
-            
-        for p in range(len(theta0)):
-                
-            # estimate
-            tic = time.time()
-            self.estimate(theta0[p],weight)
-            toc = time.time()
-                
-            # save
-            theta[p] = self.est
-            obj[p] = self.obj
+
+        # estimate from each starting value
+        self.starts = []
+        for res in self.run_starts(theta0,weight,workers,threads,context):
+            self.starts.append(res)
                 
             # print
             if options['print']:
                     
                 if options['time'] == 'sec':
-                    tid = str(np.round(toc-tic,1)) + ' sec'
+                    tid = str(np.round(res['time'],1)) + ' sec'
                 if options['time'] == 'min':
-                    tid = str(np.round((toc-tic)/60,1)) + ' min'
+                    tid = str(np.round(res['time']/60,1)) + ' min'
                 if options['time'] == 'hours':
-                    tid = str(np.round((toc-tic)/(60**2),1)) + ' hours'
+                    tid = str(np.round(res['time']/(60**2),1)) + ' hours'
                     
-                print(p+1, 'estimation:')
-                print('success:', self.est_out.success,'|', 'feval:', self.est_out.nfev, '|', 
-                      'time:', tid, '|', 'obj:', self.obj)
-                print('start par:', theta0[p])
-                print('par:      ', self.est)
+                print(res['start']+1, 'estimation:')
+                print('success:', res['success'],'|', 'feval:', res['nfev'], '|', 
+                      'time:', tid, '|', 'obj:', res['obj'])
+                print('start par:', res['theta0'])
+                print('par:      ', res['par'])
                 print('')
                     
         # final estimation
@@ -169,8 +343,8 @@ class SimulatedMinimumDistance():
         self.options['fatol'] = 0.0001
 
         # estimate
-        idx = np.argmin(obj)
-        self.estimate(theta[idx],weight)
+        best = min(self.starts,key=lambda res: res['obj'])
+        self.estimate(best['par'],weight)
         toc_total = time.time()
         
         # prints
@@ -178,31 +352,62 @@ class SimulatedMinimumDistance():
             print('final estimation:')
             print('success:', self.est_out.success,'|', 'feval:', self.est_out.nfev, '|', 'obj:', self.obj)
             print('total estimation time:', str(np.round((toc_total-tic_total)/(60**2),1)) + ' hours')
-            print('start par:', theta[idx])            
+            print('start par:', best['par'])            
             print('par:', self.est)
             print('')
 
-    def std_error(self,theta,Omega,W,Nobs,Nsim,step=1.0e-4,*args):
-        ''' Calculate standard errors and sensitivity measures '''
-
-        num_par = len(theta)
-        num_mom = len(W[0])
+    def run_starts(self,theta0,weight,workers=1,threads=1,context=None):
+        """ estimate from each starting value in theta0 and yield the results as they finish (see MultiStart) 
         
-        # 1. numerical gradient. The objective function is (data - sim)'*W*(data - sim) so take the negative of mom_sim
-        grad = np.empty((num_mom,num_par))
-        for p in range(num_par):
-            theta_now = theta[:] 
-
-            step_now  = np.zeros(num_par)
-            step_now[p] = np.fmax(step,step*theta_now[p])
-
-            self.obj_fun(theta_now + step_now,W,*args)
-            mom_forward = - self.mom_sim
-
-            self.obj_fun(theta_now - step_now,W,*args)
-            mom_backward = - self.mom_sim
-
-            grad[:,p] = (mom_forward - mom_backward)/(2.0*step_now[p])
+        Yields:
+            res (dict): start (index in theta0), theta0, par, obj, success, nfev and time (seconds)
+        """
+
+        # a. here
+        if workers == 1:
+            for p in range(len(theta0)):
+                yield self.estimate_start(p,theta0[p],weight)
+            return
+
+        # b. in a pool of workers
+        with self.pool(workers,threads,context) as ex:
+            futures = [ex.submit(_worker_estimate_start,p,theta0[p],weight) for p in range(len(theta0))]
+            for fut in as_completed(futures):
+                yield fut.result()
+
+    def estimate_start(self,p,theta0,weight):
+        """ estimate from the starting value theta0 (number p) """
+
+        tic = time.time()
+        self.estimate(theta0,weight)
+        toc = time.time()
+
+        return {'start': p, 'theta0': np.array(theta0), 'par': self.est, 'obj': self.obj,
+                'success': self.est_out.success, 'nfev': self.est_out.nfev, 'time': toc-tic}
+
+    def pool(self,workers,threads=1,context=None):
+        """ pool of worker processes, each with its own copy of the model and the estimation settings
+        
+        Args:
+            workers (int): number of processes
+            threads (int): numba threads in each process
+            context (str): multiprocessing start method. With spawn (the default) each worker compiles the model and
+                           mom_fun must be importable (e.g. MomFun, not a function defined in a notebook). fork reuses the 
+                           compiled model, but is only safe if numba's threading layer is (not with OpenMP)
+        """
+
+        settings = {'mom_data': self.mom_data, 'mom_fun': self.mom_fun, 'recompute': self.recompute, 'bounds': self.bounds,
+                    'method': self.method, 'est_par': list(self.est_par), 'options': dict(self.options), 
+                    'outputs': self.outputs, 'memo': self.memo_size, 'memo_decimals': self.memo_decimals}
+        ctx = multiprocessing.get_context('spawn' if context is None else context)
+        return ProcessPoolExecutor(workers,mp_context=ctx,initializer=_worker_init,
+                                   initargs=(model_spec(self.model),settings,threads))
+
+    def std_error(self,theta,Omega,W,Nobs,Nsim,step=1.0e-4,*args,workers=1,threads=1,context=None):
+        ''' Calculate standard errors and sensitivity measures (the gradient is evaluated in worker processes if workers > 1, see jacobian) '''
+
+        # 1. numerical gradient
+        grad,_,self.jac_info = self.jacobian(theta,W,None,step,*args,workers=workers,threads=threads,context=context)
 
         # 2. asymptotic standard errors [using Omega: V(mom_data_i). If bootstrapped, remember to multiply by Nobs]
         GW  = np.transpose(grad) @ W
@@ -214,29 +419,15 @@ class SimulatedMinimumDistance():
 
         # 3. Sensitivity measures
         self.sens1 = - np.linalg.inv(GWG) @ GW  # Andrews I, Gentzkow M, Shapiro JM: "Measuring the Sensitivity of Parameter Estimates to Estimation Moments." Quarterly Journal of Economics. 2017;132 (4) :1553-1592
-       
-    def sensitivity(self,theta,W,fixed_par_str=None,step=1.0e-4,*args):
-        ''' sensitivity measures '''
 
-        num_par = len(theta)
-        num_mom = len(W[0])
+    def sensitivity(self,theta,W,fixed_par_str=None,step=1.0e-4,*args,workers=1,threads=1,context=None):
+        ''' sensitivity measures (the gradients are evaluated in worker processes if workers > 1, see jacobian) '''
 
-        # 1. numerical gradient. The objective function is (data - sim)'*W*(data - sim) so take the negative of mom_sim
-        grad = np.empty((num_mom,num_par))
-        for p in range(num_par):
-            theta_now = theta[:] 
-
-            step_now    = np.zeros(num_par)
-            step_now[p] = np.fmax(step,step*theta_now[p])
-
-            self.obj_fun(theta_now + step_now,W,*args)
-            mom_forward = - self.mom_sim
-
-            self.obj_fun(theta_now - step_now,W,*args)
-            mom_backward = - self.mom_sim
+        # 1. numerical gradients
+        if fixed_par_str:
+            gamma = np.array([getattr(self.model.par,name) for name in fixed_par_str],dtype=float)
+        grad,grad_g,self.jac_info = self.jacobian(theta,W,fixed_par_str,step,*args,workers=workers,threads=threads,context=context)
 
-            grad[:,p] = (mom_forward - mom_backward)/(2.0*step_now[p])
-        
         # 2. Sensitivity measures
         GW  = np.transpose(grad) @ W
         GWG = GW @ grad
@@ -245,44 +436,8 @@ class SimulatedMinimumDistance():
         # 3. Sensitivity measures
         self.sens1 = Lambda  # Andrews I, Gentzkow M, Shapiro JM: "Measuring the Sensitivity of Parameter Estimates to Estimation Moments." Quarterly Journal of Economics. 2017;132 (4) :1553-1592
 
-        # reset parameters
-        for p in range(len(self.est_par)):
-            setattr(self.model.par,self.est_par[p],theta[p])
-
         # DO my suggestion
         if fixed_par_str:
-            # mine: calculate the numerical gradient wrt parameters in fixed_par
-
-            # change the estimation parameters to be the fixed ones
-            est_par = self.est_par
-            self.est_par = fixed_par_str
-
-            # construct vector of fixed values
-            gamma = np.empty(len(self.est_par))
-            for p in range(len(self.est_par)):
-                gamma[p] = getattr(self.model.par,self.est_par[p])
-
-            # calculate gradient with respect to gamma
-            num_gamma = len(gamma)
-            grad_g = np.empty((num_mom,num_gamma))
-            for p in range(num_gamma):
-                gamma_now = gamma[:] 
-
-                step_now    = np.zeros(num_gamma)
-                step_now[p] = np.fmax(step,step*gamma_now[p])
-
-                self.obj_fun(gamma_now + step_now,W,*args)
-                mom_forward = - self.mom_sim
-
-                self.obj_fun(gamma_now - step_now,W,*args)
-                mom_backward = - self.mom_sim
-
-                grad_g[:,p] = (mom_forward - mom_backward)/(2.0*step_now[p])
-
-            # reset parameters
-            for p in range(len(self.est_par)):
-                setattr(self.model.par,self.est_par[p],gamma[p])
-            self.est_par = est_par
 
             # sensitivity
             self.sens2 = Lambda @ grad_g
@@ -290,12 +445,158 @@ class SimulatedMinimumDistance():
             semi_ela = np.empty((len(theta),len(gamma)))
             for t in range(len(theta)):
                 for g in range(len(gamma)):
-                    ela[t,g] = self.sens2[t,g]*gamma[g]/theta[t]    
+                    ela[t,g] = self.sens2[t,g]*gamma[g]/theta[t]
                     semi_ela[t,g] = self.sens2[t,g]/theta[t]
 
             self.sens2e = ela
             self.sens2semi = semi_ela
 
+    def jacobian(self,theta,W,fixed_par_str=None,step=1.0e-4,*args,workers=1,threads=1,context=None,cache=True):
+        """ numerical gradient (central differences) of minus the simulated moments, since the objective function is
+        (data - sim)'*W*(data - sim), with respect to the estimated parameters at theta and the parameters in
+        fixed_par_str at their current values
+
+        Args:
+            theta (numpy.ndarray): estimated parameters (self.est_par)
+            W (numpy.ndarray): weighting matrix
+            fixed_par_str (list): fixed parameters (None for no gradient with respect to fixed parameters)
+            step (float): relative step size (at least step)
+            workers (int): number of worker processes for the evaluations (1 evaluates them here one after another)
+            threads (int): numba threads in each worker
+            context (str): multiprocessing start method (see pool)
+            cache (bool): reuse gradients from the cache in estimates/name_jacobian.pickle and add new ones to it
+
+        Returns:
+            grad (numpy.ndarray): gradient with respect to theta (num_mom x num_par)
+            grad_g (numpy.ndarray): gradient with respect to the fixed parameters (None if fixed_par_str is None)
+            info (dict): number of evaluations (nfev), workers, time in seconds (total and of each evaluation)
+                         and the blocks (theta and the fixed parameters) found in the cache
+
+        A gradient is cached by the parameters, their values, the values of all other fields in par (incl. the seed),
+        the step and the moment function, so std_error and sensitivity at the same theta share it. All evaluations
+        use the same draws (common random numbers), also in the workers, since they rebuild the model with the same
+        seed. The parameters are reset afterwards.
+        """
+
+        tic = time.time()
+        theta = np.array(theta,dtype=float)
+
+        # a. perturbations: plus and minus the step in each parameter (the parameters of the other block at their values)
+        blocks = [(list(self.est_par),theta)]
+        if fixed_par_str:
+            gamma = np.array([getattr(self.model.par,name) for name in fixed_par_str],dtype=float)
+            blocks.append((list(fixed_par_str),gamma))
+
+        if cache and self.jac_cache is None:
+            self.jac_cache = load_jacobian(self.name)
+
+        tasks = []
+        steps = []
+        keys = []
+        cached = []
+        for b,(names,x) in enumerate(blocks):
+            base = {name: val for k,(other,y) in enumerate(blocks) if k != b for name,val in zip(other,y)}
+            steps.append(np.fmax(step,step*x))
+            keys.append(jac_key(self.model,names,x,base,step,self.mom_fun))
+            if cache and keys[b] in self.jac_cache:
+                cached.append(b)
+                continue
+            for p in range(len(x)):
+                for sign in (1,-1):
+                    x_now = x.copy()
+                    x_now[p] += sign*steps[b][p]
+                    tasks.append((names,x_now,base))
+
+        # b. evaluate
+        if workers == 1:
+            mom = []
+            times = []
+            est_par = self.est_par
+            for names,x_now,base in tasks:
+                tic_now = time.time()
+                set_par(self.model,base)
+                self.est_par = names
+                self.obj_fun(x_now,W,*args)
+                mom.append(-self.mom_sim)
+                times.append(time.time()-tic_now)
+            self.est_par = est_par
+
+            # reset parameters
+            for names,x in blocks:
+                set_par(self.model,dict(zip(names,x)))
+
+        else:
+            with self.pool(workers,threads,context) as ex:
+                futures = [ex.submit(_worker_moments,names,x_now,base,W,args) for names,x_now,base in tasks]
+                out = [fut.result() for fut in futures]
+            mom = [-m for m,_ in out]
+            times = [t for _,t in out]
+
+        # c. central differences
+        mom = np.array(mom)
+        grads = []
+        i = 0
+        for b,(names,x) in enumerate(blocks):
+            if b in cached:
+                grads.append(self.jac_cache[keys[b]])
+                continue
+            n = len(x)
+            grads.append(np.transpose(mom[i:i+2*n:2] - mom[i+1:i+2*n:2])/(2.0*steps[b]))
+            i += 2*n
+            if cache:
+                self.jac_cache[keys[b]] = grads[b]
+        if cache and len(tasks) > 0:
+            save_jacobian(self.name,self.jac_cache)
+        grad = grads[0]
+        grad_g = grads[1] if fixed_par_str else None
+
+        info = {'nfev': len(tasks), 'workers': workers, 'time': time.time()-tic, 'time_eval': np.array(times),
+                'cached': [['theta','fixed'][b] for b in cached]}
+        return grad,grad_g,info
+
+def set_par(model,values):
+    """ set parameters in model.par (and in the single model of a couple model if it has them) """
+    for key,val in values.items():
+        setattr(model.par,key,val)
+        if model.couple and hasattr(model.Single.par,key):
+            setattr(model.Single.par,key,val)
+
+def model_spec(model):
+    """ keyword arguments for RetirementClass that rebuild model (e.g. in another process) """
+
+    def par(m):
+        snap = setup.snapshot(m.par)
+        del snap['couple']
+        return {key: val.item() if val.ndim == 0 else val for key,val in snap.items()}
+
+    spec = {'name': model.name, 'couple': model.couple, 'year': model.year, 'cache': model.cache, **par(model)}
+    if model.couple:
+        spec['single_kwargs'] = par(model.Single)
+    return spec
+
+# estimation in a worker process (see SimulatedMinimumDistance.pool)
+_worker = None
+
+def _worker_init(spec,settings,threads):
+    """ build the model and the estimation in a worker process """
+
+    global _worker
+    import numba
+    from Model import RetirementClass
+    numba.set_num_threads(threads)
+    _worker = SimulatedMinimumDistance(RetirementClass(**spec),**settings)
+
+def _worker_estimate_start(p,theta0,weight):
+    return _worker.estimate_start(p,theta0,weight)
+
+def _worker_moments(names,theta,base,W,args):
+    """ simulated moments with the parameters names at theta (the parameters in base are set first) and the time it took """
+    tic = time.time()
+    set_par(_worker.model,base)
+    _worker.est_par = names
+    _worker.obj_fun(theta,W,*args)
+    return _worker.mom_sim,time.time()-tic
+
 def MomFun(model,bootstrap=False,B=200,ages=[58,68]):
     """ wrapper for computing moments (bootstrap is optional)"""
 
@@ -346,22 +647,23 @@ def Moments(sim,par,Ssim,Spar,idx_singles,idx_couples,idx_joint,ages):
     marg_S = np.zeros((2,len(x)))
     idx_men = idx_singles[Ssim.states[idx_singles,0] == 1]
     idx_women = idx_singles[Ssim.states[idx_singles,0] == 0]
-    marg_S[0] = np.nanmean(probs_S[idx_men],axis=0)         # men
-    marg_S[1] = np.nanmean(probs_S[idx_women],axis=0)       # women
+    marg_S[0] = funs.nanwmean(probs_S[idx_men],Ssim.w[idx_men])           # men
+    marg_S[1] = funs.nanwmean(probs_S[idx_women],Ssim.w[idx_women])       # women
 
     # 2. Couples
     marg_C = np.zeros((2,len(x)))
-    marg_C[0] = np.nanmean(probs_C[idx_couples,:,1],axis=0)   # men
-    marg_C[1] = np.nanmean(probs_C[idx_couples,:,0],axis=0)   # women
+    marg_C[0] = funs.nanwmean(probs_C[idx_couples,:,1],sim.w[idx_couples])     # men
+    marg_C[1] = funs.nanwmean(probs_C[idx_couples,:,0],sim.w[idx_couples])     # women
     
     # 3. Joint retirement
     mom_joint = np.zeros(len(ADx))
-    ret_w = np.nanargmin(sim.d[idx_joint,:,0],axis=1)
-    ret_h = np.nanargmin(sim.d[idx_joint,:,1],axis=1) 
+    ret_w = np.argmax(sim.d[idx_joint,:,0]==0,axis=1)  # first period retired
+    ret_h = np.argmax(sim.d[idx_joint,:,1]==0,axis=1) 
     diff = -(ret_h-ret_w+AD[idx_joint])  # add age difference to put them on the same time scale    
+    w = sim.w[idx_joint]
     for j in range(len(ADx)):
         ad = ADx[j]
-        mom_joint[j] = np.sum(diff==ad)
+        mom_joint[j] = np.sum(w[diff==ad])
     mom_joint = mom_joint/np.sum(mom_joint)
 
     # return 
@@ -376,15 +678,59 @@ def joint_moments_ad(model,ad):
     idx = np.nonzero(np.any(sim.d[:,:,0]==0,axis=1) & (np.any(sim.d[:,:,1]==0,axis=1) &
                     (AD==ad)))[0]
     mom_joint = np.zeros(len(ADx))
-    ret_w = np.nanargmin(sim.d[idx,:,0],axis=1)
-    ret_h = np.nanargmin(sim.d[idx,:,1],axis=1) 
+    ret_w = np.argmax(sim.d[idx,:,0]==0,axis=1)    # first period retired
+    ret_h = np.argmax(sim.d[idx,:,1]==0,axis=1) 
     diff = -(ret_h-ret_w+ad)  # add age difference to put them on the same time scale    
+    w = sim.w[idx]
     for j in range(len(ADx)):
         adx = ADx[j]
-        mom_joint[j] = np.sum(diff==adx)
-    mom_joint = mom_joint/np.sum(mom_joint)    
+        mom_joint[j] = np.sum(w[diff==adx])
+    mom_joint = mom_joint/np.sum(mom_joint)
     return mom_joint
 
+def draws_variance(model,R=10,sim_draws=(0,1,2),mom_fun=MomFun):
+    """ variance of the simulated moments across R seeds for iid, antithetic and Sobol draws (model must be solved)
+
+    Args:
+        model (class): solved model
+        R (int): number of seeds
+        sim_draws (tuple): draw schemes to compare (see par.sim_draws)
+        mom_fun (function): moments of a simulated model
+
+    Returns:
+        var (dict): variance of each moment for each draw scheme
+        ratio (dict): total variance relative to iid draws (0.25 means the same precision with a quarter of the agents)
+    """
+
+    # models to reinitialize
+    models = [model, model.Single] if model.couple else [model]
+    seed = model.par.sim_seed
+    draws0 = model.par.sim_draws
+
+    # 1. moments for each draw scheme and seed
+    var = {}
+    for s in sim_draws:
+        mom = []
+        for r in range(R):
+            for m in models:
+                m.par.sim_seed = seed + r
+                m.par.sim_draws = s
+                setup.init_sim(m.par,m.sim)
+            model.simulate()
+            mom.append(mom_fun(model))
+        var[s] = np.nanvar(np.array(mom),axis=0,ddof=1)
+
+    # 2. restore
+    for m in models:
+        m.par.sim_seed = seed
+        m.par.sim_draws = draws0
+        setup.init_sim(m.par,m.sim)
+
+    # 3. relative to iid
+    ratio = {s: np.nansum(var[s])/np.nansum(var[sim_draws[0]]) for s in sim_draws}
+
+    return var,ratio
+
 
 def start(N,bounds):
     ''' uniformly sample starting values '''
@@ -459,6 +805,39 @@ def identification(model,true_par,est_par,true_save,par_save,par_latex,start,end
     else:
         return x1,x2,y
 
+def hash_par(h,model,exclude,base={}):
+    """ update the hash h with the fields in par (and in the single model of a couple model) except those in exclude
+    (the values in base replace those in par) """
+
+    models = [model, model.Single] if model.couple else [model]
+    for m in models:
+        values = setup.snapshot(m.par)
+        values.update({key: val for key,val in base.items() if key in values})
+        for name in sorted(values):
+            if name not in exclude:
+                h.update(name.encode() + np.asarray(values[name],dtype=float).tobytes())
+
+def jac_key(model,names,x,base,step,mom_fun):
+    """ key of a gradient in the cache (see SimulatedMinimumDistance.jacobian) """
+
+    h = hashlib.sha1()
+    hash_par(h,model,names,base)
+    h.update(repr((list(names),[float(val) for val in x],float(step),getattr(mom_fun,'__name__',''))).encode())
+    return h.hexdigest()
+
+def load_jacobian(name):
+    """ cached gradients of the estimation name from "estimates"-folder (empty if there are none) """
+    try:
+        with open('estimates/'+str(name)+'_jacobian.pickle', 'rb') as handle:
+            return pickle.load(handle)
+    except FileNotFoundError:
+        return {}
+
+def save_jacobian(name,cache):
+    """ save cached gradients of the estimation name to "estimates"-folder """
+    with open('estimates/'+str(name)+'_jacobian.pickle', 'wb') as handle:
+        pickle.dump(cache, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
 def save_est(est_par,theta,name):
     """ save estimated parameters to "estimates"-folder """
     EstDict = dict(zip(est_par,theta))
@@ -0,0 +1,87 @@
+# global modules
+import numpy as np
+from numba import njit, prange
+
+##################################
+####         streams         #####
+##################################
+# one stream per kind of draw, so every draw is identified by (sim_seed, stream, agent, period, k)
+WEALTH = 0
+CHOICE = 1
+DEATH = 2
+SHOCKS = 3
+
+# Philox4x32-10 constants
+M0 = np.uint64(0xD2511F53)
+M1 = np.uint64(0xCD9E8D57)
+W0 = np.uint64(0x9E3779B9)
+W1 = np.uint64(0xBB67AE85)
+MASK = np.uint64(0xFFFFFFFF)
+SHIFT = np.uint64(32)
+
+##################################
+####     counter based rng   #####
+##################################
+@njit
+def philox(c0,c1,c2,c3,k0,k1):
+    """ Philox4x32-10 block: 4 random 32 bit integers from the counter (c0,c1,c2,c3) and the key (k0,k1) """
+
+    # to unsigned 32 bit (stored in 64 bit)
+    c0 = np.uint64(c0) & MASK
+    c1 = np.uint64(c1) & MASK
+    c2 = np.uint64(c2) & MASK
+    c3 = np.uint64(c3) & MASK
+    k0 = np.uint64(k0) & MASK
+    k1 = np.uint64(k1) & MASK
+
+    # 10 rounds
+    for _ in range(10):
+        p0 = M0*c0
+        p1 = M1*c2
+        c0,c1,c2,c3 = ((p1 >> SHIFT) ^ c1 ^ k0), (p1 & MASK), ((p0 >> SHIFT) ^ c3 ^ k1), (p0 & MASK)
+        k0 = (k0 + W0) & MASK
+        k1 = (k1 + W1) & MASK
+
+    return c0,c1,c2,c3
+
+@njit
+def to_unit(x0,x1):
+    """ uniform in the open interval (0,1) with 53 bit precision from two 32 bit integers """
+    return (np.float64(x0 >> np.uint64(5))*67108864.0 + np.float64(x1 >> np.uint64(6)) + 0.5)/9007199254740992.0
+
+@njit(parallel=True)
+def uniform(seed,stream,ids,T,K):
+    """ uniform draws
+
+    Args:
+        seed (int): simulation seed (par.sim_seed)
+        stream (int): kind of draw (see streams above)
+        ids (numpy.ndarray): agent ids
+        T (int): number of periods
+        K (int): number of draws per agent and period
+
+    Returns:
+        u (numpy.ndarray): draws of shape (len(ids),T,K), where u[i,t,k] only depends on (seed,stream,ids[i],t,k)
+    """
+
+    u = np.empty((ids.size,T,K))
+    for i in prange(ids.size):
+        for t in range(T):
+            for k in range(K):
+                x0,x1,_,_ = philox(ids[i],t,k,0,seed,stream)
+                u[i,t,k] = to_unit(x0,x1)
+    return u
+
+@njit(parallel=True)
+def normal(seed,stream,ids,T,K):
+    """ standard normal draws (Box-Muller), where z[i,t,k] only depends on (seed,stream,ids[i],t,k) """
+
+    z = np.empty((ids.size,T,K))
+    for i in prange(ids.size):
+        for t in range(T):
+            for k in range(K):
+                x0,x1,x2,x3 = philox(ids[i],t,k,0,seed,stream)
+                u0 = to_unit(x0,x1)
+                u1 = to_unit(x2,x3)
+                z[i,t,k] = np.sqrt(-2*np.log(u0))*np.cos(2*np.pi*u1)
+    return z
@@ -13,6 +13,7 @@ from consav import linear_interp
 # local modules
 import transitions
 import funs
+import setup
 lw = 3
 fs = 17
 def MyPlot(G,xlim=None,ylim=None,save=True,**kwargs):
@@ -416,16 +417,16 @@ def lifecycle(model,var,MA=[0],ST=[0,1,2,3],ages=[57,68],calc='mean'):
                     ('alive','$alive_t$')])
 
         x = np.arange(ages[0], ages[1]+1)
-        simdata = getattr(sim,var)[:,transitions.inv_age(x,par)]
-        y = simdata[idx,:]
+        y = funs.panel(sim,var,idx)[:,transitions.inv_age(x,par)]
+        w = sim.w[idx]
         with warnings.catch_warnings(): # ignore this specific warning
             warnings.simplefilter("ignore", category=RuntimeWarning)
             if calc == 'mean':
-                y = np.nanmean(y,axis=0)
+                y = funs.nanwmean(y,w,axis=0)
             elif calc == 'sum':
-                y = np.nansum(y,axis=0)
+                y = funs.nanwsum(y,w,axis=0)
             elif calc == 'total_sum':
-                y = np.nansum(y)
+                y = funs.nanwsum(y,w,axis=None)
 
         # return
         if var in ('m', 'c', 'a', 'GovS'):
@@ -458,24 +459,24 @@ def lifecycle_c(model,var,MA=[0,1],AD=[-4,-3,-2,-1,0,1,2,3,4],ST_h=[0,1,2,3],ST_
     x = np.arange(ages[0], ages[1]+1)
     axis = 0
     if var in ('m', 'c', 'a', 'GovS'):
-        simdata = getattr(sim,var)[:,transitions.inv_age(x,par)]
+        y = getattr(sim,var)[idx][:,transitions.inv_age(x,par)]
     elif var in ('d', 'alive'):
-        simdata = getattr(sim,var)[:,transitions.inv_age(x,par)+par.ad_min]
-        simdata = simdata[:,:,MA]
+        y = funs.panel(sim,var,idx)[:,transitions.inv_age(x,par)+par.ad_min]
+        y = y[:,:,MA]
         if len(MA)>1:
             axis = (0,2)
+    w = sim.w[idx]
     
-    y = simdata[idx]
     with warnings.catch_warnings(): # ignore this specific warning
         warnings.simplefilter("ignore", category=RuntimeWarning)
         if calc == 'mean':
-            y = np.nanmean(y,axis=axis)
+            y = funs.nanwmean(y,w,axis=axis)
             y = y.ravel()
         elif calc == 'sum':
-            y = np.nansum(y,axis=axis)
+            y = funs.nanwsum(y,w,axis=axis)
             y = y.ravel()
         elif calc == 'total_sum':
-            y = np.nansum(y)
+            y = funs.nanwsum(y,w,axis=None)
     
     # return
     if var in ('m', 'c', 'a', 'GovS'):
@@ -498,9 +499,9 @@ def retirement_probs(model,MA=[0],ST=[0,1,2,3],ages=[58,68]):
     
     # figure
     x = np.arange(ages[0], ages[1]+1)
-    y = sim.probs[:,transitions.inv_age(x,par)] # ages
-    y = y[idx,:]                                # states
-    y = np.nanmean(y,axis=0)
+    y = funs.panel(sim,'probs',idx)             # states
+    y = y[:,transitions.inv_age(x,par)]         # ages
+    y = funs.nanwmean(y,sim.w[idx],axis=0)
 
     # return
     return {'y': [y], 'x': x, 'xticks': x, 'xlabel': 'Age', 'ylabel': 'Retirement probability', 'label': ['Predicted']}
@@ -520,16 +521,17 @@ def retirement_probs_c(model,ma,AD=[-4,-3,-2,-1,0,1,2,3,4],ST_h=[0,1,2,3],ST_w=[
     
     # figure
     x = np.arange(ages[0], ages[1]+1)
-    y = sim.probs[:,transitions.inv_age(x,par)+par.ad_min,ma]  # ages
-    y = y[idx,:]                                               # states
+    y = funs.panel(sim,'probs',idx)                            # states
+    y = y[:,transitions.inv_age(x,par)+par.ad_min,ma]          # ages
     with warnings.catch_warnings(): # ignore this specific warning
         warnings.simplefilter("ignore", category=RuntimeWarning)
-        y = np.nanmean(y,axis=0)    
+        y = funs.nanwmean(y,sim.w[idx],axis=0)
     
     # return
     return {'y': [y], 'x': x, 'xticks': x, 'xlabel': 'Age', 'ylabel': 'Retirement probability', 'label': ['Predicted']}
 
-def RetAge_S(model,MA=[0,1],ST=[0,1,2,3]):
+def RetAge_S(model,MA=[0,1],ST=[0,1,2,3],weights=False):
+    """ retirement ages of singles (and their population weights if weights=True) """
     
     par = model.par
     sim = model.sim
@@ -540,12 +542,15 @@ def RetAge_S(model,MA=[0,1],ST=[0,1,2,3]):
     idx = np.nonzero((np.any(sim.d==0,axis=1)) & (np.isin(MAx,MA)) & (np.isin(STx,ST)))[0]
     
     # distribution of retirement ages
-    age = np.nanmax(np.arange(par.start_T,par.start_T+par.simT)*sim.d[idx],axis=1)+1
+    age = np.nanmax(np.arange(par.start_T,par.start_T+par.simT)*funs.panel(sim,'d',idx),axis=1)+1
 
     # return
+    if weights:
+        return age,sim.w[idx]
     return age
 
-def RetAge_C(model,ma,AD=[-4,-3,-2,-1,0,1,2],ST_h=[0,1,2,3],ST_w=[0,1,2,3]):
+def RetAge_C(model,ma,AD=[-4,-3,-2,-1,0,1,2],ST_h=[0,1,2,3],ST_w=[0,1,2,3],weights=False):
+    """ retirement ages in couples (and their population weights if weights=True) """
 
     par = model.par
     sim = model.sim
@@ -559,11 +564,19 @@ def RetAge_C(model,ma,AD=[-4,-3,-2,-1,0,1,2],ST_h=[0,1,2,3],ST_w=[0,1,2,3]):
 
     # distribution of retirement ages
     age = np.nanmax(np.arange(par.start_T-par.ad_min,par.start_T+par.simT+par.ad_max)*
-                    sim.d[idx,:,ma],axis=1)+1
+                    funs.panel(sim,'d',idx)[:,:,ma],axis=1)+1
 
     # return
+    if weights:
+        return age,sim.w[idx]
     return age    
 
+def RetAge_mean(*groups):
+    """ weighted mean of retirement ages from RetAge_S or RetAge_C (with weights=True) for one or more groups """
+    age = np.concatenate([g[0] for g in groups])
+    w = np.concatenate([g[1] for g in groups])
+    return np.sum(age*w)/np.sum(w)
+
 def policy_simulation(model,var,ages):
     """ policy simulation for singles"""
 
@@ -588,11 +601,11 @@ def policy_simulation(model,var,ages):
         return lifecycle(model,var=var,MA=[0,1],ST=[0,1,2,3],ages=ages,calc='total_sum')['y'][0]
 
     if var == 'RetAge':
-        return {'hs': np.mean(RetAge_S(model,ST=[1,3])),
-                'base_f': np.mean(RetAge_S(model,MA=[0])),
-                'base_m': np.mean(RetAge_S(model,MA=[1])),
-                'base': np.mean(RetAge_S(model)),
-                'ls': np.mean(RetAge_S(model,ST=[0,2]))
+        return {'hs': RetAge_mean(RetAge_S(model,ST=[1,3],weights=True)),
+                'base_f': RetAge_mean(RetAge_S(model,MA=[0],weights=True)),
+                'base_m': RetAge_mean(RetAge_S(model,MA=[1],weights=True)),
+                'base': RetAge_mean(RetAge_S(model,weights=True)),
+                'ls': RetAge_mean(RetAge_S(model,ST=[0,2],weights=True))
                 }
 
 def policy_simulation_c(model,var,ages):
@@ -622,18 +635,18 @@ def policy_simulation_c(model,var,ages):
 
     if var == 'RetAge':
         return {'hs': 
-                np.mean(np.concatenate((RetAge_C(model,ma=0,ST_w=[1,3]),
-                                        RetAge_C(model,ma=1,ST_h=[1,3])))),
+                RetAge_mean(RetAge_C(model,ma=0,ST_w=[1,3],weights=True),
+                            RetAge_C(model,ma=1,ST_h=[1,3],weights=True)),
                 'base_m':
-                np.mean(RetAge_C(model,ma=1)),
+                RetAge_mean(RetAge_C(model,ma=1,weights=True)),
                 'base_f':
-                np.mean(RetAge_C(model,ma=0)),
+                RetAge_mean(RetAge_C(model,ma=0,weights=True)),
                 'base': 
-                np.mean(np.concatenate((RetAge_C(model,ma=0),
-                                        RetAge_C(model,ma=1)))),
+                RetAge_mean(RetAge_C(model,ma=0,weights=True),
+                            RetAge_C(model,ma=1,weights=True)),
                 'ls': 
-                np.mean(np.concatenate((RetAge_C(model,ma=0,ST_w=[0,2]),
-                                        RetAge_C(model,ma=1,ST_h=[0,2]))))
+                RetAge_mean(RetAge_C(model,ma=0,ST_w=[0,2],weights=True),
+                            RetAge_C(model,ma=1,ST_h=[0,2],weights=True))
                 }                                         
 
 # def resolve(model,vars,recompute=True,accuracy=False,tax=True,ages=[57,110],**kwargs):
@@ -664,7 +677,7 @@ def policy_simulation_c(model,var,ages):
 #     # return
 #     return store 
 
-def resolve_c(model,vars,recompute=True,accuracy=False,tax=True,
+def resolve_c(model,vars,recompute=True,accuracy=False,tax=True,widow=False,
               AD=[-4,-3,-2,-1,0,1,2,3,4],ST_h=[0,1,2,3],ST_w=[0,1,2,3],ages=[53,110],**kwargs):
 
     # dict
@@ -686,7 +699,7 @@ def resolve_c(model,vars,recompute=True,accuracy=False,tax=True,
             
         # solve and simulate
         model.solve(recompute=recompute)
-        model.simulate(accuracy=accuracy,tax=tax)
+        model.simulate(accuracy=accuracy,tax=tax,widow=widow)
 
         # policy
         for var in vars:
@@ -703,6 +716,67 @@ def resolve_c(model,vars,recompute=True,accuracy=False,tax=True,
     # return
     return {'couple': couple, 'single': single}
 
+def resolve_tax(model,vars,accuracy=False,tax=True,widow=False,ages=[53,110],**kwargs):
+    """ resolve_c for changes in the tax system only (e.g. fradrag=[0.0,0.1,0.2])
+    
+    Only the income tables and the simulated labor income are recomputed (see setup.PRECOMPUTE), and the 
+    simulation uses the same draws. tau_max follows the tax rates unless it is given. The tax system of the 
+    model is reset afterwards.
+
+    Returns:
+        the same dict as resolve_c
+    """
+
+    # a. tax parameters only
+    other = [key for key in kwargs if key not in setup.TAX]
+    if other:
+        raise ValueError(f'{other} are not tax parameters (setup.TAX), use resolve_c')
+
+    # b. maximum tax rate
+    rates = ('tau_l','tau_m','tau_u','tau_c','tau_h','tau_upper')
+    if 'tau_max' not in kwargs and any(key in kwargs for key in rates):
+        N = len(list(kwargs.values())[0])
+        rate = lambda key,v: kwargs[key][v] if key in kwargs else getattr(model.par,key)
+        kwargs['tau_max'] = [rate('tau_l',v) + rate('tau_m',v) + rate('tau_u',v) + rate('tau_c',v) + rate('tau_h',v) 
+                             - rate('tau_upper',v) for v in range(N)]
+
+    # c. resolve and reset
+    models = (model,model.Single)
+    base = [{key: getattr(m.par,key) for key in kwargs} for m in models]
+    try:
+        return resolve_c(model,vars,recompute=True,accuracy=accuracy,tax=tax,widow=widow,ages=ages,**kwargs)
+    finally:
+        for m,b in zip(models,base):
+            for key,val in b.items():
+                setattr(m.par,key,val)
+            m.recompute()
+
+def resolve_regimes(model,vars,regimes=['2008'],**kwargs):
+    """ resolve_c for each regime in regimes.yaml (only the precomputations the regimes differ in are rerun)
+
+    Args:
+        model (class): couple model
+        vars (list): variables to return
+        regimes (list): names of the regimes
+        kwargs (dict): passed on to resolve_c
+
+    Returns:
+        the same dict as resolve_c with one element for each regime (the model is left in the last regime)
+    """
+
+    # fields of the regimes (fields a regime does not set keep their current value)
+    specs = [setup.regime(name,model.par.denom) for name in regimes]
+    fields = {}
+    for spec in specs:
+        for key in list(spec['tax']) + list(spec['retirement']):
+            fields[key] = []
+    for spec in specs:
+        values = {**spec['tax'], **spec['retirement']}
+        for key in fields:
+            fields[key].append(values.get(key,getattr(model.par,key)))
+
+    return resolve_c(model,vars,**kwargs,**fields)
+
 def sens_fig_tab(sens,sense,theta,est_par_tex,fixed_par_tex,save=True):
     
     fs = 17
@@ -148,7 +148,48 @@ def logsum4(V, par):
 
     return logsum,prob
 
+def panel(sim,var,idx=None):
+    """ simulated panel in double precision with nan where it is not observed
 
+    Args:
+        sim (class): simulation
+        var (str): name of the variable (alive is computed from the period of death)
+        idx (array): agents to return (all if None)
+
+    Returns:
+        panel of shape (agents,T) for singles or (agents,T,2) for couples
+    """
+
+    if idx is None:
+        idx = slice(None)
+
+    if var == 'alive':
+        t = np.arange(sim.d.shape[1])
+        death = sim.death[idx]
+        if death.ndim == 1:
+            return (t[None,:] < death[:,None]).astype(float)
+        else:
+            return (t[None,:,None] < death[:,None,:]).astype(float)
+
+    elif var == 'd':
+        d = sim.d[idx]
+        y = d.astype(float)
+        y[d < 0] = np.nan   # -1 is the sentinel for not observed
+        return y
+
+    else:
+        return getattr(sim,var)[idx].astype(float)
+
+def nanwmean(y,w,axis=0):
+    """ mean of y weighted with the population weights w of the agents (first axis of y), ignoring nan """
+    w = w.reshape((-1,)+(1,)*(y.ndim-1))
+    obs = ~np.isnan(y)
+    return np.sum(np.where(obs,y,0)*w,axis=axis)/np.sum(obs*w,axis=axis)
+
+def nanwsum(y,w,axis=0):
+    """ sum of y weighted with the population weights w of the agents (first axis of y), ignoring nan """
+    w = w.reshape((-1,)+(1,)*(y.ndim-1))
+    return np.sum(np.where(np.isnan(y),0,y)*w,axis=axis)
 
 def resolve(model,**kwargs):
     """ resolve model and plot euler errors
@@ -0,0 +1,300 @@
+# global modules
+import numpy as np
+import pandas as pd
+
+# local modules
+import transitions
+import simulate
+import setup
+
+##################################
+####      help functions     #####
+##################################
+def lottery(grid,x,mass):
+    """ split the mass at the points x linearly between the two neighbouring points on the grid
+    (mass outside the grid goes to the end points) """
+    Na = grid.size
+    i = np.clip(np.searchsorted(grid,x,side='right')-1,0,Na-2)
+    w = np.clip((x-grid[i])/(grid[i+1]-grid[i]),0,1)
+    return np.bincount(i,mass*(1-w),Na) + np.bincount(i+1,mass*w,Na)
+
+def init_dist(par,data,states,perc_num=10,Nq=10):
+    """ initial distribution of wealth on the grid in each state cell
+
+    Args:
+        par (class): parameters
+        data (DataFrame): population share (Frac) and percentiles of wealth in each cell
+        states (numpy.ndarray): states of the cells (same columns as sim.states)
+        perc_num (int): number of percentiles
+        Nq (int): number of points between each percentile (setup.pc_sample draws uniformly between the percentiles)
+
+    Returns:
+        frac (numpy.ndarray): population share of each cell
+        dist (numpy.ndarray): distribution of initial wealth on the grid in each cell (rows sum to 1)
+    """
+
+    # points with equal mass
+    percentiles = np.linspace(0,100,perc_num+1).astype(int)
+    bins = data[list(percentiles)].to_numpy()
+    u = (np.arange(Nq)+0.5)/Nq
+    x = (bins[:,:-1,None] + (bins[:,1:]-bins[:,:-1])[:,:,None]*u).reshape(len(bins),-1)
+
+    # add private pension wealth and put on the grid
+    x = x + setup.pension_wealth(par,states)[:,None]
+    dist = np.zeros((len(bins),par.grid_a.size))
+    for i in range(len(bins)):
+        dist[i] = lottery(par.grid_a,x[i],np.ones(x.shape[1])/x.shape[1])
+
+    return data['Frac'].to_numpy(),dist
+
+def next_ra(t,elig,ra,d,par):
+    """ retirement status next period (see simulate.update_ra) """
+    if d == 1 and elig == 1:
+        if t+1 >= par.T_two_year:
+            return 0
+        elif t+1 >= par.T_erp:
+            return 1
+    return ra
+
+##################################
+####         Singles         #####
+##################################
+def single(sol,par,perc_num=10,Nq=10,tol=1e-12):
+    """ push the distribution of singles over (ra, d, m on the grid) forward in each state cell
+
+    Args:
+        sol (class): solution
+        par (class): parameters
+        perc_num (int): number of percentiles in the wealth data
+        Nq (int): number of points between each percentile in the initial distribution
+        tol (float): mass below tol is not pushed forward
+
+    Returns:
+        probs (numpy.ndarray): population mean of the retirement probabilities of shape (simT,2) (women first),
+                               on the same time index as sim.probs
+    """
+
+    # initial distribution
+    data = pd.read_excel('SASdata/single_formue.xlsx')
+    states = par.iterator
+    frac,dist0 = init_dist(par,data,states,perc_num,Nq)
+
+    # prep
+    grid = par.grid_a
+    Na = grid.size
+    idx = np.arange(Na)
+    m = np.repeat(grid.reshape(Na,1),par.simT,axis=1)    # every period on the grid (look up with simulate.ConsValue)
+    num = np.zeros((par.simT,2))
+    den = np.zeros((par.simT,2))
+
+    for i in range(len(states)):
+        ma = states[i,0]
+        st = states[i,1]
+        elig = transitions.state_translate(st,'elig',par)
+        if frac[i] == 0:
+            continue
+
+        # mass over (ra,d,m) (all are working with ra=2 in the first period)
+        mass = np.zeros((3,2,Na))
+        mass[2,1] = frac[i]*dist0[i]
+
+        for t in range(par.simT-1):
+            mass_plus = np.zeros((3,2,Na))
+            pi = transitions.survival_lookup_single(t+1,ma,st,par)
+            for ra in range(3):
+                for ds in range(2):
+                    mu = mass[ra,ds]
+                    if np.sum(mu) < tol:
+                        continue
+
+                    # consumption and retirement probability
+                    c_interp,prob = simulate.ConsValue(t,ma,st,ra,ds,m,sol,par,idx)
+                    if ds == 1 and t+1 < par.Tr-1:
+                        choices = ((0,prob,c_interp[:,0]),(1,1-prob,c_interp[:,1]))
+                    elif ds == 1:
+                        prob = np.ones(Na)
+                        choices = ((0,prob,c_interp[:,0]),)
+                    else:
+                        prob = np.zeros(Na)
+                        choices = ((0,1-prob,c_interp[:,0]),)
+                    num[t+1,ma] += np.sum(mu*prob)
+                    den[t+1,ma] += np.sum(mu)
+
+                    # next period: survival, income (integrate over shocks if working) and wealth
+                    ra_plus = next_ra(t,elig,ra,ds,par)
+                    for d_plus,p,c in choices:
+                        a = grid-c
+                        inc = transitions.inc_lookup_single(d_plus,t+1,ma,st,ra_plus,par)
+                        w = par.xi_w[ma] if d_plus == 1 else np.ones(1)
+                        for k in range(inc.size):
+                            mass_plus[ra_plus,d_plus] += lottery(grid,par.R*a+inc[k],pi*w[k]*p*mu)
+            mass = mass_plus
+
+    # population means
+    with np.errstate(invalid='ignore'):
+        return num/den
+
+##################################
+####         Couples         #####
+##################################
+# labor market status of couples: both working, both retired and the one of them that retired first
+# (with the number of periods since, up to the largest gap in the joint retirement moments)
+GAP = 7
+
+def status(d_h,d_w,k=0):
+    """ index of the labor market status (k is the number of periods since the first of them retired) """
+    if d_h == 1 and d_w == 1:
+        return 0
+    elif d_h == 0 and d_w == 0:
+        return 1
+    elif d_h == 0 and d_w == 1:
+        return 2 + min(k,GAP+1)
+    elif d_h == 1 and d_w == 0:
+        return 2 + (GAP+2) + min(k,GAP+1)
+
+def status_inv(s):
+    """ labor market status (d_h,d_w,k) of an index """
+    if s == 0:
+        return 1,1,0
+    elif s == 1:
+        return 0,0,0
+    elif s < 2 + (GAP+2):
+        return 0,1,s-2
+    else:
+        return 1,0,s-2-(GAP+2)
+
+def couple(sol,par,perc_num=10,Nq=10,tol=1e-12):
+    """ push the distribution of couples over (ra_h, ra_w, labor market status, m on the grid) forward in each state cell
+
+    Args:
+        sol (class): solution
+        par (class): parameters
+        perc_num (int): number of percentiles in the wealth data
+        Nq (int): number of points between each percentile in the initial distribution
+        tol (float): mass below tol is not pushed forward
+
+    Returns:
+        probs (numpy.ndarray): population mean of the retirement probabilities of shape (simT+extend,2) (women first),
+                               on the same time index as sim.probs
+        gap (numpy.ndarray): mass of couples where the wife retires k periods after the husband for k = -GAP,...,GAP
+    """
+
+    # initial distribution
+    data = pd.read_excel('SASdata/couple_formue.xlsx')
+    states = par.iterator
+    frac,dist0 = init_dist(par,data,states,perc_num,Nq)
+
+    # prep
+    grid = par.grid_a
+    Na = grid.size
+    idx = np.arange(Na)
+    m = np.repeat(grid.reshape(Na,1),par.simT,axis=1)    # every period on the grid (look up with simulate.ConsValue_c)
+    extend = par.ad_min + par.ad_max
+    NS = 2 + 2*(GAP+2)
+    num = np.zeros((par.simT+extend,2))
+    den = np.zeros((par.simT+extend,2))
+    gap = np.zeros(2*GAP+1)
+
+    for i in range(len(states)):
+        ad = states[i,0]
+        st_h = states[i,1]
+        st_w = states[i,2]
+        elig_h = transitions.state_translate(st_h,'elig',par)
+        elig_w = transitions.state_translate(st_w,'elig',par)
+        if frac[i] == 0:
+            continue
+
+        # mass over (status,ra_h,ra_w,m) (both are working with ra=2 in the first period)
+        mass = np.zeros((NS,3,3,Na))
+        mass[status(1,1),2,2] = frac[i]*dist0[i]
+
+        for t in range(par.simT-1):
+            mass_plus = np.zeros((NS,3,3,Na))
+            pi_h,pi_w = transitions.survival_lookup_couple(t+1,ad,st_h,st_w,par)
+            th_idx = t+1+par.ad_min
+            tw_idx = t+1+ad+par.ad_min
+            for s in range(NS):
+                dh,dw,k = status_inv(s)
+                for ra_h in range(3):
+                    for ra_w in range(3):
+                        mu = mass[s,ra_h,ra_w]
+                        if np.sum(mu) < tol:
+                            continue
+
+                        # consumption and retirement probabilities (choices are drawn independently, see simulate.optimal_choices_c)
+                        c_interp,prob_h,prob_w = simulate.ConsValue_c(t,ad,st_h,st_w,ra_h,ra_w,dh,dw,m,sol,par,idx)
+                        if dh == 1 and t+1 >= par.Tr-1:
+                            prob_h = np.ones(Na)
+                        if dw == 1 and t+1+ad >= par.Tr-1:
+                            prob_w = np.ones(Na)
+                        num[th_idx,1] += np.sum(mu*prob_h)
+                        num[tw_idx,0] += np.sum(mu*prob_w)
+                        den[th_idx,1] += np.sum(mu)
+                        den[tw_idx,0] += np.sum(mu)
+
+                        # probability of being retired next period
+                        ret_h = prob_h if dh == 1 else np.ones(Na)
+                        ret_w = prob_w if dw == 1 else np.ones(Na)
+                        ra_plus_h = next_ra(t,elig_h,ra_h,dh,par)
+                        ra_plus_w = next_ra(t+ad,elig_w,ra_w,dw,par)
+
+                        for dh_plus in (0,1):
+                            for dw_plus in (0,1):
+                                p = (ret_h if dh_plus == 0 else 1-ret_h)*(ret_w if dw_plus == 0 else 1-ret_w)
+                                if np.sum(mu*p) < tol:
+                                    continue
+
+                                # joint retirement (retirement is observed next period, also for those who die)
+                                if dh == 1 and dw == 1:
+                                    k_plus = 0
+                                    if dh_plus == 0 and dw_plus == 0:
+                                        gap[GAP] += np.sum(mu*p)
+                                else:
+                                    k_plus = k+1
+                                    if dh_plus == 0 and dw_plus == 0 and (dh,dw) != (0,0) and k_plus <= GAP:
+                                        gap[GAP + (k_plus if dh == 0 else -k_plus)] += np.sum(mu*p)
+
+                                # next period: survival of both, income (integrate over shocks if working) and wealth
+                                c = c_interp[:,transitions.d_c(dh_plus,dw_plus)]
+                                a = grid-c
+                                inc = transitions.inc_lookup_couple(dh_plus,dw_plus,t+1,ad,st_h,st_w,ra_plus_h,ra_plus_w,par)
+                                if dh_plus == 1 and dw_plus == 1:
+                                    w = par.w_corr
+                                elif dh_plus == 1:
+                                    w = par.xi_w[1]
+                                elif dw_plus == 1:
+                                    w = par.xi_w[0]
+                                else:
+                                    w = np.ones(1)
+                                s_plus = status(dh_plus,dw_plus,k_plus)
+                                for j in range(inc.size):
+                                    mass_plus[s_plus,ra_plus_h,ra_plus_w] += lottery(grid,par.R*a+inc[j],pi_h*pi_w*w[j]*p*mu)
+            mass = mass_plus
+
+    # population means
+    with np.errstate(invalid='ignore'):
+        return num/den,gap
+
+##################################
+####         moments         #####
+##################################
+def MomFun(model,ages=[58,68],perc_num=10,Nq=10):
+    """ moments from the distributions of singles and couples (the same layout as SimulatedMinimumDistance.MomFun) """
+
+    # unpack
+    par = model.par
+    Spar = model.Single.par
+
+    # distributions
+    probs_S = single(model.Single.sol,Spar,perc_num,Nq)
+    probs_C,gap = couple(model.sol,par,perc_num,Nq)
+
+    # moments
+    x = np.arange(ages[0], ages[1]+1)
+    xS = transitions.inv_age(x,Spar)
+    xC = transitions.inv_age(x,par)+par.ad_min
+    marg_S = np.array([probs_S[xS,1], probs_S[xS,0]])   # men then women
+    marg_C = np.array([probs_C[xC,1], probs_C[xC,0]])   # men then women
+    mom_joint = gap/np.sum(gap)
+
+    return np.concatenate((marg_S.ravel(), marg_C.ravel(), mom_joint))
@@ -1,8 +1,12 @@
 # global modules
-from numba import boolean, int32, int64, float64, double, njit, typeof
+from numba import boolean, int8, uint8, int32, int64, float32, float64, double, njit, typeof
 import numpy as np
 import itertools
+import warnings
 import pandas as pd
+import hashlib
+import yaml
+from scipy import special
 
 # consav package
 from consav import misc 
@@ -10,6 +14,7 @@ from consav import misc
 # local modules
 import transitions
 import funs
+import draws
 
 def single_lists():
 
@@ -21,6 +26,7 @@ def single_lists():
             # misc
             ('denom',double),
             ('tol',double),
+            ('sol_tables',boolean),
 
             # time parameters
             ('start_T',int32),
@@ -30,6 +36,9 @@ def single_lists():
 
             # simulation            
             ('sim_seed',int32),
+            ('sim_rng',int32),
+            ('sim_draws',int32),
+            ('sim_alloc',int32),
             ('simN',int32),
 
             # savings
@@ -140,6 +149,9 @@ def single_lists():
             ('m',double[:]),
             ('v',double[:,:,:,:,:,:]),      
 
+            # retirement probabilities (empty if not par.sol_tables)
+            ('prob',double[:,:,:,:,:]),
+
             # post decision
             ('avg_marg_u_plus',double[:,:,:,:,:,:]), 
             ('v_plus_raw',double[:,:,:,:,:,:])                      
@@ -151,11 +163,11 @@ def single_lists():
             ('c',double[:,:]),            
             ('m',double[:,:]),                 
             ('a',double[:,:]),
-            ('d',double[:,:]),
+            ('d',int8[:,:]),                # -1 if not observed
 
             # misc
-            ('probs',double[:,:]), 
-            ('RA',int32[:]),
+            ('probs',float32[:,:]), 
+            ('RA',uint8[:]),
             ('euler',double[:,:]),
             ('GovS',double[:,:]),
 
@@ -165,7 +177,9 @@ def single_lists():
 
             # setup
             ('choiceP',double[:,:,:]),
-            ('alive',int32[:,:]),      
+            ('death',uint8[:]),             # period of death (alive if t < death)
+            ('w',double[:]),                # population weight of each agent (mean 1)
+            ('m_init',double[:]),           # wealth in the first period (incl. private pension)
             ('labor_pre',double[:,:,:]),
             ('labor_post',double[:,:,:]),
             ('states',int32[:,:])
@@ -211,6 +225,9 @@ def couple_lists():
             ('c',double[:,:,:,:,:,:,:,:]),
             ('m',double[:]),
             ('v',double[:,:,:,:,:,:,:,:]),                     
+
+            # retirement probabilities (empty if not par.sol_tables)
+            ('prob',double[:,:,:,:,:,:,:,:]),
                 
         ]     
 
@@ -220,21 +237,24 @@ def couple_lists():
             ('c',double[:,:]),            
             ('m',double[:,:]),                 
             ('a',double[:,:]),
-            ('d',double[:,:,:]),
+            ('d',int8[:,:,:]),              # -1 if not observed
 
             # misc
-            ('probs',double[:,:,:]), 
-            ('RA',int32[:,:]),
+            ('probs',float32[:,:,:]), 
+            ('RA',uint8[:,:]),
             ('euler',double[:,:]),
             ('GovS',double[:,:]),
 
             # booleans
             ('accuracy',boolean),
             ('tax',boolean),   
+            ('widow',boolean),
 
             # setup
             ('choiceP',double[:,:,:]), 
-            ('alive',int32[:,:,:]),      
+            ('death',uint8[:,:]),           # period of death (alive if t < death)
+            ('w',double[:]),                # population weight of each agent (mean 1)
+            ('m_init',double[:]),           # wealth in the first period (incl. private pension)
             ('shocks_joint',double[:,:,:]),            
             ('labor_pre',double[:,:,:]),
             ('labor_post',double[:,:,:]),
@@ -246,65 +266,159 @@ def couple_lists():
 
     return parlist,sollist,simlist
 
-def TaxSystem(model):
-    """ Tax system for either 2008 or 2014 """
+# monetary amounts in the regimes (in DKR in regimes.yaml)
+MONEY = ('WD_upper','y_low','y_low_m','y_low_u','B','y_B','D_B','D_s','A_i','y_i','D_i','ERP_low','ERP_high','ERP_2')
 
-    # unpack
-    par = model.par
+def regime(name,denom,path='regimes.yaml'):
+    """ tax and retirement system from the table of regimes
 
-    if model.year == 2008:
-
-        par.IRA_tax = 0.4               # tax for IRA (kapitalpension)
-        par.fradrag_to_oap = 1          # age difference to oap age
-        par.fradrag = 0.0               # deduction for old workers (policy proposal)
-        par.tau_upper = 0.59            # maximum tax rate (skatteloft)
-        par.tau_LMC = 0.08              # labor market contribution (arbejdsmarkedsbidrag)
-        par.WD = 0.4                    # working deduction (beskæftigelsesfradrag)
-        par.WD_upper = 12300/par.denom  # maximum deduction possible (beskæftigelsesfradrag, maksimal)
-        par.tau_c = 0.2554              # average county-specific rate (including 0.073 in church tax)
-        par.y_low = 41000/par.denom     # amount deductible from all income (personfradrag)
-        par.y_low_m = 279800/par.denom  # amount deductible from middle tax bracket (mellemskattegrænse)
-        par.y_low_u = 335800/par.denom  # amount deductible from top tax bracket (topskattegrænse)
-        par.tau_h = 0.08                # health contribution tax (sundhedsbidrag)
-        par.tau_l = 0.0548              # tax rate in lowest tax bracket (bundskat)
-        par.tau_m = 0.06                # tax rate in middle tax bracket (mellemskat)
-        par.tau_u = 0.15                # tax rate in upper tax bracket (topskat)
-        par.tau_max = par.tau_l + par.tau_m + par.tau_u + par.tau_c + par.tau_h - par.tau_upper         
-    
-    elif model.year == 2014:
-        pass  
+    Args:
+        name (str): name of the regime (e.g. '2008')
+        denom (float): denomination of monetary amounts (par.denom)
+        path (str): yaml file with the regimes
+
+    Returns:
+        (dict): values of the tax system (key 'tax') and the retirement system (key 'retirement')
+    """
 
-def RetirementSystem(model): 
-    """ Retirement system for either 2008 or 2014 """     
+    with open(path) as f:
+        regimes = yaml.safe_load(f)
+    name = str(name)
+    if name not in regimes:
+        raise ValueError(f'regime {name} is not in {path}, choose from {list(regimes)}')
+
+    # base regime
+    spec = regimes[name]
+    if 'base' in spec:
+        out = regime(spec['base'],denom,path)
+    else:
+        out = {'tax': {}, 'retirement': {}}
+
+    # override
+    for system in ('tax','retirement'):
+        for key,val in spec.get(system,{}).items():
+            val = np.array(val,dtype=float) if isinstance(val,list) else val
+            out[system][key] = val/denom if key in MONEY else val
+
+    # maximum tax rate
+    tax = out['tax']
+    if all(key in tax for key in ('tau_l','tau_m','tau_u','tau_c','tau_h','tau_upper')):
+        tax['tau_max'] = tax['tau_l'] + tax['tau_m'] + tax['tau_u'] + tax['tau_c'] + tax['tau_h'] - tax['tau_upper']
+
+    return out
+
+def TaxSystem(model,name=None):
+    """ tax system of the regime name (default: model.year) in regimes.yaml """
 
     # unpack
     par = model.par
+    name = model.year if name is None else name
 
-    if model.year == 2008:
+    for key,val in regime(name,par.denom)['tax'].items():
+        setattr(par,key,val)
 
-        # ages
-        par.oap_age = 65
-        par.two_year = 62
-        par.erp_age = 60
-        
-        # oap
-        par.B = 61152/par.denom                                 # base rate
-        par.y_B = 463500/par.denom                              # maximum annual income before loss of OAP_B
-        par.tau_B = 0.3                                         # marginal reduction in deduction regarding income
-        par.D_B = 259700/par.denom                              # deduction regarding base value of OAP
-        par.D_s = 179400/par.denom                              # maximum deduction in spousal income
-        par.A_i = np.array([61560, 28752, 28752])/par.denom     # maximum OAP_A
-        par.y_i = np.array([153100, 210800, 306600])/par.denom  # maximum income before loss of OAP_A
-        par.tau_i = np.array([0.3, 0.3, 0.15])                  # marginal reduction in OAP_A
-        par.D_i = np.array([57300, 115000, 115000])/par.denom   # maximum deduction regarding OAP_A
-        
-        # erp
-        par.ERP_low = 12600/par.denom                           # deduction
-        par.ERP_high = 166400/par.denom                         # maximum erp if two year rule is not satisfied
-        par.ERP_2 = 182780/par.denom                            # erp with two year rule
+def RetirementSystem(model,name=None):
+    """ retirement system of the regime name (default: model.year) in regimes.yaml """
 
-    elif model.year == 2014:
-        pass
+    # unpack
+    par = model.par
+    name = model.year if name is None else name
+
+    for key,val in regime(name,par.denom)['retirement'].items():
+        setattr(par,key,val)
+
+# parameters of the tax system in posttax
+TAX = ('tau_upper','tau_LMC','WD','WD_upper','fradrag','fradrag_to_oap','tau_c','y_low','y_low_m','y_low_u','tau_h','tau_l','tau_m','tau_u','tau_max')
+
+# precomputations in the order they are run (see RetirementClass.recompute) with the fields in par and the earlier stages they depend on
+PRECOMPUTE = {
+    'time': ('start_T','end_T','forced_T','oap_age','erp_age','two_year','MA','ST','AD'),                           # model_time
+    'grids': ('time','tol','a_max','a_phi','Na','Nxi','var','cov','Nxi_men','Nxi_women'),                           # grids
+    'survival': ('time','reg_survival_male','reg_survival_female','pi_adjust_m','pi_adjust_f'),                     # transitions.precompute_survival
+    'sim': ('time','survival','simN','simT','sim_seed','sim_rng','sim_draws','sim_alloc',
+            'g_adjust','priv_pension_female','priv_pension_male','IRA_tax','denom'),                                 # init_sim_states
+    'labor': ('sim','var','cov','reg_labor_male','reg_labor_female')+TAX,                                           # init_sim_shocks
+    'income': ('time','grids','sim','reg_labor_male','reg_labor_female','B','y_B','tau_B','D_B','D_s',
+               'A_i','y_i','tau_i','D_i','ERP_low','ERP_high','ERP_2')+TAX                                          # transitions.precompute_inc_single/couple
+}
+
+# fields in par that no precomputation depends on
+NO_PRECOMPUTE = ('couple','sol_tables','R','rho','beta','alpha_0_male','alpha_0_female','alpha_1','gamma','v',
+                 'sigma_eta','pareto_w','phi_0_male','phi_0_female','phi_1')
+
+# fields in par that are set by the precomputations
+PRECOMPUTED = ('T','Tr','T_oap','T_erp','T_two_year','ad_min','ad_max','iterator','grid_a','xi','xi_w','xi_corr','w_corr',
+               'survival','pension_female','pension_male','simM_init','oap','labor','erp','inc_pens','inc_mixed','inc_joint')
+
+# tables set by the precomputations that are cached on disk (see RetirementClass.recompute)
+TABLES = {
+    'survival': ('survival',),
+    'income': ('oap','labor','erp','inc_pens','inc_mixed','inc_joint')
+}
+
+def cache_fields(stage):
+    """ fields in par that the tables of stage are a function of (the private pension from the simulated states 
+    instead of the fields in the sim stage, which the tables only depend on through it) """
+
+    fields = ['couple']
+    for dep in PRECOMPUTE[stage]:
+        if dep == 'sim':
+            fields += ['pension_female','pension_male']
+        elif dep in PRECOMPUTE:
+            fields += cache_fields(dep)
+        else:
+            fields.append(dep)
+    return fields
+
+def cache_key(par,stage):
+    """ hash of the fields in par that the tables of stage are a function of """
+
+    names = set(name for name,_ in (couple_lists() if par.couple else single_lists())[0])
+    h = hashlib.sha1(stage.encode())
+    for name in sorted(set(cache_fields(stage)) & names):
+        x = np.asarray(getattr(par,name))
+        h.update(name.encode() + str(x.shape).encode() + x.astype(np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+def snapshot(par):
+    """ copy of the fields in par that the precomputations depend on """
+
+    names = [name for name,_ in (couple_lists() if par.couple else single_lists())[0]]
+    return {name: np.copy(getattr(par,name)) for name in names if name not in PRECOMPUTED}
+
+def stale(par,snap):
+    """ precomputations that must be rerun since snap was taken (all if snap is None or an unknown field has changed)
+
+    Args:
+        par (class): parameters
+        snap (dict): snapshot of par from the last precomputation (or None)
+
+    Returns:
+        stages (list): names of the stages in PRECOMPUTE to rerun (in order)
+    """
+
+    if snap is None:
+        return list(PRECOMPUTE)
+
+    # a. changed fields
+    changed = set()
+    for name,old in snap.items():
+        new = getattr(par,name)
+        if np.shape(new) != old.shape or not np.array_equal(new,old):
+            changed.add(name)
+
+    # b. unknown fields invalidate everything
+    known = set(NO_PRECOMPUTE).union(*PRECOMPUTE.values())
+    if not changed <= known:
+        return list(PRECOMPUTE)
+
+    # c. stages depending on a changed field or a stale stage
+    stages = []
+    for stage,deps in PRECOMPUTE.items():
+        if any(dep in changed or dep in stages for dep in deps):
+            stages.append(stage)
+
+    return stages
 
 def model_time(par):
     """ translate variables to model time and generate iterator for solving"""
@@ -361,74 +475,169 @@ def grids(par):
         par.xi_corr,par.w_corr = funs.GH_lognorm_corr(par.var,par.cov,par.Nxi_men,par.Nxi_women)    
 
 def init_sim(par,sim):
-    """ initialize simulation """
-    
+    """ initialize simulation (par.sim_rng=0: numpy's global generator, par.sim_rng=1: counter based streams in draws,
+    par.sim_draws=1 or 2: antithetic or Sobol draws) """
+
+    rng_state = init_sim_states(par,sim)
+    init_sim_shocks(par,sim,rng_state)
+
+def init_sim_states(par,sim):
+    """ initialize states, m and period of death in the simulation
+
+    Returns:
+        rng_state (tuple): state of numpy's global generator after the draws (None if par.sim_rng=1),
+                           init_sim_shocks continues from it
+    """
+
     # initialize m and states
-    np.random.seed(par.sim_seed)
+    if par.sim_rng == 0:
+        np.random.seed(par.sim_seed)
     state_and_m(par,sim,perc_num=10)
 
+    # period of death
     if par.couple:
-
-        # setup
         init_sim_couple(par,sim)
-        
+    else:
+        init_sim_single(par,sim)
+
+    if par.sim_rng == 0:
+        return np.random.get_state()
+
+def init_sim_shocks(par,sim,rng_state=None):
+    """ draw income shocks and initialize labor income in the simulation (the same draws for a given rng_state from init_sim_states) """
+
+    if rng_state is not None:
+        np.random.set_state(rng_state)
+
+    if par.couple:
+
         # draws
         Tr = min(par.simT,par.Tr)        
         mu = -0.5*par.var      
         Cov = np.array(([par.var[0], par.cov], [par.cov, par.var[1]]))      
-        shocks_joint = np.exp(np.random.multivariate_normal(mu,Cov,size=(par.simN,min(par.simT,par.Tr))))
-        shocks_w = np.exp(np.random.normal(mu[0], np.sqrt(par.var[0]), size=(par.simN,Tr+par.ad_min)))
-        shocks_h = np.exp(np.random.normal(mu[1], np.sqrt(par.var[1]), size=(par.simN,Tr+par.ad_min)))            
+        if par.sim_rng == 0 and par.sim_draws == 0:
+            shocks_joint = np.exp(np.random.multivariate_normal(mu,Cov,size=(par.simN,min(par.simT,par.Tr))))
+            shocks_w = np.exp(np.random.normal(mu[0], np.sqrt(par.var[0]), size=(par.simN,Tr+par.ad_min)))
+            shocks_h = np.exp(np.random.normal(mu[1], np.sqrt(par.var[1]), size=(par.simN,Tr+par.ad_min)))            
+        else:
+            z = normals(par,sim,draws.SHOCKS,Tr+par.ad_min,4)    # joint (women, men) and individual (women, men)
+            shocks_joint = np.exp(mu + z[:,:Tr,:2] @ np.transpose(np.linalg.cholesky(Cov)))
+            shocks_w = np.exp(mu[0] + np.sqrt(par.var[0])*z[:,:,2])
+            shocks_h = np.exp(mu[1] + np.sqrt(par.var[1])*z[:,:,3])
         
         # income
         init_sim_labor_couple(par,sim,shocks_joint,shocks_w,shocks_h)
     
     else:
 
-        # setup
-        init_sim_single(par,sim)
-        
         # draws
-        shocks = np.nan*np.zeros((par.simN,min(par.simT,par.Tr),2))
-        shocks[:,:,0] = np.exp(np.random.normal(-0.5*par.var[0], np.sqrt(par.var[0]), size=(par.simN,min(par.simT,par.Tr))))
-        shocks[:,:,1] = np.exp(np.random.normal(-0.5*par.var[1], np.sqrt(par.var[1]), size=(par.simN,min(par.simT,par.Tr))))        
+        if par.sim_rng == 0 and par.sim_draws == 0:
+            shocks = np.nan*np.zeros((par.simN,min(par.simT,par.Tr),2))
+            shocks[:,:,0] = np.exp(np.random.normal(-0.5*par.var[0], np.sqrt(par.var[0]), size=(par.simN,min(par.simT,par.Tr))))
+            shocks[:,:,1] = np.exp(np.random.normal(-0.5*par.var[1], np.sqrt(par.var[1]), size=(par.simN,min(par.simT,par.Tr))))        
+        else:
+            z = normals(par,sim,draws.SHOCKS,min(par.simT,par.Tr),2)
+            shocks = np.exp(-0.5*par.var + np.sqrt(par.var)*z)
         
         # income
         init_sim_labor_single(par,sim,shocks)        
 
+def uniforms(par,sim,stream,T,K):
+    """ uniform draws of shape (simN,T,K) 
+    
+    Args:
+        par (class): parameters (sim_rng picks the generator and sim_draws picks iid (0), antithetic (1) or Sobol (2) draws)
+        sim (class): simulation (states define the cells for antithetic and Sobol draws)
+        stream (int): kind of draw (see draws)
+        T (int): number of periods
+        K (int): number of draws per agent and period
+
+    Returns:
+        u (numpy.ndarray): draws
+    """
+
+    # quasi monte carlo
+    if par.sim_draws == 2:
+        return sobol(par,sim,stream,T,K)
+
+    # pseudo random
+    if par.sim_rng == 0:
+        u = np.random.rand(par.simN,T,K)
+    else:
+        u = draws.uniform(par.sim_seed,stream,np.arange(par.simN),T,K)
+    if par.sim_draws == 1:
+        antithetic(sim,u,1-u)
+    return u
+
+def normals(par,sim,stream,T,K):
+    """ standard normal draws of shape (simN,T,K) (see uniforms) """
+
+    # quasi monte carlo
+    if par.sim_draws == 2:
+        u = np.clip(sobol(par,sim,stream,T,K),1e-12,1-1e-12)
+        return special.ndtri(u)
+
+    # pseudo random
+    if par.sim_rng == 0:
+        z = np.random.standard_normal((par.simN,T,K))
+    else:
+        z = draws.normal(par.sim_seed,stream,np.arange(par.simN),T,K)
+    if par.sim_draws == 1:
+        antithetic(sim,z,-z)
+    return z
+
+def cells(sim):
+    """ first and last (+1) agent in each state cell (agents in a cell are next to each other, see state_and_m) """
+    change = np.nonzero(np.any(np.diff(sim.states,axis=0) != 0,axis=1))[0] + 1
+    bounds = np.concatenate((np.zeros(1,dtype=int),change,np.array([len(sim.states)])))
+    return list(zip(bounds[:-1],bounds[1:]))
+
+def antithetic(sim,x,x_anti):
+    """ replace the second half of the agents in each cell with the antithetic draws of the first half """
+    for i0,i1 in cells(sim):
+        h = (i1-i0)//2
+        x[i0+h:i0+2*h] = x_anti[i0:i0+h]
+
+def sobol(par,sim,stream,T,K):
+    """ scrambled Sobol points (one dimension per period and draw) for the agents in each cell """
+    
+    from scipy.stats import qmc    # requires scipy >= 1.7
+
+    u = np.empty((par.simN,T,K))
+    for c,(i0,i1) in enumerate(cells(sim)):
+        engine = qmc.Sobol(d=T*K,scramble=True,seed=np.random.default_rng([par.sim_seed,stream,c]))
+        with warnings.catch_warnings(): # balance properties are only exact for powers of 2
+            warnings.simplefilter('ignore')
+            u[i0:i1] = engine.random(i1-i0).reshape(i1-i0,T,K)
+    return u
+
 def init_sim_single(par,sim):
     """ initialize simulation for single model """
 
     # random draws       
-    sim.choiceP = np.random.rand(par.simN,par.simT,1)                            
-    deadP = np.random.rand(par.simN,par.simT) 
+    sim.choiceP = uniforms(par,sim,draws.CHOICE,par.simT,1)                            
+    deadP = uniforms(par,sim,draws.DEATH,par.simT,1)[:,:,0] 
 
     # precompute
     MA = sim.states[:,0]
     MAx = np.unique(MA)
     ST = sim.states[:,1]
     STx = np.unique(ST)
-    sim.alive = np.ones((par.simN,par.simT),dtype=int)
-    alive = sim.alive  
-    for t in range(par.simT):
-
-        # if they are dead, they stay dead
-        if t > 0:
-            alive[alive[:,t-1] == 0,t] = 0
 
+    # period of death (they are all alive first period)
+    sim.death = np.full(par.simN,par.simT,dtype=np.uint8)
+    death = sim.death
+    for t in range(1,par.simT):
         for ma in MAx:
             for st in STx:
 
                 # indices
                 idx = np.nonzero((MA==ma) & (ST==st))[0]
 
-                # alive status (they are all alive first period)
-                if t > 0:
-
-                    # alive status
-                    pi = transitions.survival_lookup_single(t,ma,st,par)
-                    dead = idx[pi < deadP[idx,t]]
-                    alive[dead,t] = 0
+                # if they are dead, they stay dead
+                pi = transitions.survival_lookup_single(t,ma,st,par)
+                dead = idx[(pi < deadP[idx,t]) & (death[idx] > t)]
+                death[dead] = t
 
 @njit(parallel=True)
 def init_sim_labor_single(par,sim,shocks):
@@ -441,7 +650,6 @@ def init_sim_labor_single(par,sim,shocks):
     STx = np.unique(ST)
 
     # initialize
-    np.random.seed(par.sim_seed+1)
     sim.labor_pre = np.nan*np.zeros((par.simN,min(par.simT,par.Tr),2))
     sim.labor_post = np.nan*np.zeros((par.simN,min(par.simT,par.Tr),2))  
     labor_pre = sim.labor_pre
@@ -466,8 +674,8 @@ def init_sim_couple(par,sim):
     ad_min = par.ad_min
     ad_max = par.ad_max
     extend = ad_min + ad_max    
-    sim.choiceP = np.random.rand(par.simN,par.simT+extend,2)
-    deadP = np.random.rand(par.simN,par.simT+extend,2)  
+    sim.choiceP = uniforms(par,sim,draws.CHOICE,par.simT+extend,2)
+    deadP = uniforms(par,sim,draws.DEATH,par.simT+extend,2)  
             
     # precompute
     AD = sim.states[:,0]
@@ -477,31 +685,30 @@ def init_sim_couple(par,sim):
     ST_hx = np.unique(ST_h)
     ST_wx = np.unique(ST_w)
 
-    # 1. alive status
-    sim.alive = np.ones((par.simN,par.simT+extend,2),dtype=int)
-    alive_w = sim.alive[:,:,0]
-    alive_h = sim.alive[:,:,1]
-    alive_h[:,-ad_max:] = 0 # last period for men, which we never reach
+    # 1. period of death (on the time index of the extended arrays)
+    sim.death = np.zeros((par.simN,2),dtype=np.uint8)
+    death_w = sim.death[:,0]
+    death_h = sim.death[:,1]
+    death_w[:] = par.simT+extend
+    death_h[:] = par.simT+extend-ad_max # last period for men, which we never reach
     deadP_w = deadP[:,:,0]
     deadP_h = deadP[:,:,1]
-    for t in range(par.simT):
-        if t > 0:
-            for ad in ADx:  
+    for t in range(1,par.simT):
+        for ad in ADx:  
 
-                tw_idx = t+ad+par.ad_min
-                th_idx = t+par.ad_min
-                alive_w[alive_w[:,tw_idx-1] == 0, tw_idx] = 0
-                alive_h[alive_h[:,th_idx-1] == 0, th_idx] = 0
+            tw_idx = t+ad+par.ad_min
+            th_idx = t+par.ad_min
 
-                for st_h in ST_hx:
-                    for st_w in ST_wx:
-                                                
-                        pi_h,pi_w = transitions.survival_lookup_couple(t,ad,st_h,st_w,par) 
-                        idx = np.nonzero((AD==ad) & (ST_h==st_h) & (ST_w==st_w))[0]                              
-                        dead_w = idx[pi_w < deadP_w[idx,tw_idx]]
-                        dead_h = idx[pi_h < deadP_h[idx,th_idx]]
-                        alive_w[dead_w,tw_idx] = 0
-                        alive_h[dead_h,th_idx] = 0
+            for st_h in ST_hx:
+                for st_w in ST_wx:
+
+                    # if they are dead, they stay dead
+                    pi_h,pi_w = transitions.survival_lookup_couple(t,ad,st_h,st_w,par) 
+                    idx = np.nonzero((AD==ad) & (ST_h==st_h) & (ST_w==st_w))[0]                              
+                    dead_w = idx[(pi_w < deadP_w[idx,tw_idx]) & (death_w[idx] > tw_idx)]
+                    dead_h = idx[(pi_h < deadP_h[idx,th_idx]) & (death_h[idx] > th_idx)]
+                    death_w[dead_w] = tw_idx
+                    death_h[dead_h] = th_idx
 
 @njit(parallel=True)
 def init_sim_labor_couple(par,sim,shocks_joint,shocks_w,shocks_h):
@@ -514,8 +721,8 @@ def init_sim_labor_couple(par,sim,shocks_joint,shocks_w,shocks_h):
     ADx = np.unique(AD)
     ST_hx = np.unique(ST_h)
     ST_wx = np.unique(ST_w)
-    alive_w = sim.alive[:,:,0]
-    alive_h = sim.alive[:,:,1]    
+    death_w = sim.death[:,0]
+    death_h = sim.death[:,1]    
 
     # time
     ad_min = par.ad_min
@@ -545,16 +752,16 @@ def init_sim_labor_couple(par,sim,shocks_joint,shocks_w,shocks_h):
             # husband
             for st_h in np.unique(ST_h):
                 if t < par.Tr:      # not forced to retire
-                    idx_h = np.nonzero((alive_h[:,th_idx]==1) & (ST_h==st_h))[0]
+                    idx_h = np.nonzero((death_h > th_idx) & (ST_h==st_h))[0]
                     labor_pre[idx_h,th_idx,1] = transitions.labor_pretax(t_h,1,st_h,par)*shocks_h[idx_h,t]
-                    labor_post[idx_h,th_idx,1] = transitions.posttax(t_h,par,d=1,inc=labor_pre[idx_h,th_idx,1],inc_s=np.inf*np.ones(len(idx_h)))    # set spouse of inc to infinity so no shared deduction
+                    labor_post[idx_h,th_idx,1] = transitions.posttax(t_h,par,d=1,inc=labor_pre[idx_h,th_idx,1],inc_s=np.inf*np.ones(len(idx_h)),d_s=0)    # set spouse of inc to infinity so no shared deduction
 
             # wife
             for st_w in np.unique(ST_w):
                 if t+ad < par.Tr:   # not forced to retire
-                    idx_w = np.nonzero((alive_w[:,tw_idx]==1) & (ST_w==st_w))[0]
+                    idx_w = np.nonzero((death_w > tw_idx) & (ST_w==st_w))[0]
                     labor_pre[idx_w,tw_idx,0] = transitions.labor_pretax(t_w,0,st_w,par)*shocks_w[idx_w,t]
-                    labor_post[idx_w,tw_idx,0] = transitions.posttax(t_w,par,d=1,inc=labor_pre[idx_w,tw_idx,0],inc_s=np.inf*np.ones(len(idx_w)))
+                    labor_post[idx_w,tw_idx,0] = transitions.posttax(t_w,par,d=1,inc=labor_pre[idx_w,tw_idx,0],inc_s=np.inf*np.ones(len(idx_w)),d_s=0)
 
     # joint labor income (if they both work)
     for t in range(Tr):
@@ -566,7 +773,7 @@ def init_sim_labor_couple(par,sim,shocks_joint,shocks_w,shocks_h):
                         # indices
                         th_idx = t+ad_min
                         tw_idx = t+ad+ad_min                        
-                        idx = np.nonzero((alive_h[:,th_idx]==1) & (alive_w[:,tw_idx]==1) & (AD==ad) & (ST_h==st_h) & (ST_w==st_w))[0]
+                        idx = np.nonzero((death_h > th_idx) & (death_w > tw_idx) & (AD==ad) & (ST_h==st_h) & (ST_w==st_w))[0]
                         
                         # pre tax
                         pre_h = transitions.labor_pretax(t,1,st_h,par)*shocks_joint[idx,t,1]
@@ -587,8 +794,7 @@ def state_and_m(par,sim,perc_num=10):
         # set states
         data = pd.read_excel('SASdata/couple_formue.xlsx')
         states = par.iterator
-        n_groups = (data['Frac'].to_numpy()*par.simN).astype(int)
-        n_groups[-1] = par.simN-np.sum(n_groups[:-1])   # assure it sums to simN
+        n_groups = allocate(par,data,perc_num)
         sim.states = np.transpose(np.vstack((np.repeat(states[:,0],n_groups),
                                              np.repeat(states[:,1],n_groups),
                                              np.repeat(states[:,2],n_groups))))
@@ -598,33 +804,49 @@ def state_and_m(par,sim,perc_num=10):
         # set states
         data = pd.read_excel('SASdata/single_formue.xlsx')
         states = par.iterator
-        n_groups = (data['Frac'].to_numpy()*par.simN).astype(int)
-        n_groups[-1] = par.simN-np.sum(n_groups[:-1])   # to assure it sums to simN
+        n_groups = allocate(par,data,perc_num)
         sim.states = np.transpose(np.vstack((np.repeat(states[:,0],n_groups),
                                              np.repeat(states[:,1],n_groups))))
         
+    # population weights (equal if the agents are allocated proportional to the population)
+    if par.sim_alloc == 0:
+        sim.w = np.ones(par.simN)
+    else:
+        sim.w = np.repeat(data['Frac'].to_numpy()*par.simN/np.maximum(n_groups,1),n_groups)
+
     # initial liquid wealth
     m_init = np.zeros(len(sim.states))
     idx = np.concatenate((np.zeros(1), np.cumsum(n_groups))).astype(int)
     percentiles = np.linspace(0,100,perc_num+1).astype(int)
     bins = data[list(percentiles)].to_numpy()
+    legacy = (par.sim_rng == 0 and par.sim_draws == 0)
+    if not legacy:
+        u = uniforms(par,sim,draws.WEALTH,1,1).ravel()
     for i in range(n_groups.size):
-        m_init[idx[i]:idx[i+1]] = pc_sample(n_groups[i], percentiles, bins[i])
+        if legacy:
+            u_group = np.random.rand(n_groups[i])
+        else:
+            u_group = u[idx[i]:idx[i+1]]
+        m_init[idx[i]:idx[i+1]] = pc_sample(n_groups[i], percentiles, bins[i], u_group)
     par.simM_init = m_init
 
     # add private pension wealth to liquid wealth
     adjust_pension(par,sim)
+    sim.m_init = m_init + pension_wealth(par,sim.states)
     sim.m = np.nan*np.zeros((par.simN,par.simT))
-    sim.m[:,0] = m_init
-    states = sim.states
+    sim.m[:,0] = sim.m_init
 
+def pension_wealth(par,states):
+    """ private pension wealth (after tax) in initial liquid wealth for each row of states """
+
+    wealth = np.zeros(len(states))
     if par.couple:
         for st_h in range(len(par.ST)):
             for st_w in range(len(par.ST)):
                 idx = np.nonzero((states[:,1]==st_h) & (states[:,2]==st_w))[0]
                 hs_h = transitions.state_translate(st_h,'high_skilled',par)
                 hs_w = transitions.state_translate(st_w,'high_skilled',par)
-                sim.m[idx,0] += (1-par.IRA_tax)*(par.pension_male[hs_h] + par.pension_female[hs_w])
+                wealth[idx] = (1-par.IRA_tax)*(par.pension_male[hs_h] + par.pension_female[hs_w])
 
     else:
         for ma in par.MA:
@@ -632,22 +854,66 @@ def state_and_m(par,sim,perc_num=10):
                 idx = np.nonzero((states[:,0]==ma) & (states[:,1]==st))[0]
                 hs = transitions.state_translate(st,'high_skilled',par)
                 if ma == 0:
-                    sim.m[idx,0] += (1-par.IRA_tax)*par.pension_female[hs]
+                    wealth[idx] = (1-par.IRA_tax)*par.pension_female[hs]
                 elif ma == 1:
-                    sim.m[idx,0] += (1-par.IRA_tax)*par.pension_male[hs]
+                    wealth[idx] = (1-par.IRA_tax)*par.pension_male[hs]
+
+    return wealth
         
-def pc_sample(N,percentiles,bins):
-    """ N samples from a dsitribution given its percentiles and bins (assumes equal spacing between percentiles)"""
+def allocate(par,data,perc_num=10):
+    """ number of agents in each state cell
+    
+    Args:
+        par (class): parameters (sim_alloc=0: proportional to the population, 1: equal in all populated cells, 
+                     2: Neyman, proportional to the population times the std. of initial wealth in the cell)
+        data (DataFrame): population share (Frac) and percentiles of wealth in each cell
+        perc_num (int): number of percentiles
+
+    Returns:
+        n_groups (numpy.ndarray): number of agents in each cell (sums to simN)
+    """
+
+    frac = data['Frac'].to_numpy()
+    
+    # proportional
+    if par.sim_alloc == 0:
+        n_groups = (frac*par.simN).astype(int)
+        n_groups[-1] = par.simN-np.sum(n_groups[:-1])   # assure it sums to simN
+        return n_groups
+
+    # equal or neyman
+    if par.sim_alloc == 1:
+        share = 1.0*(frac > 0)
+    elif par.sim_alloc == 2:
+        percentiles = np.linspace(0,100,perc_num+1).astype(int)
+        share = frac*pc_std(data[list(percentiles)].to_numpy())
+    share = share/np.sum(share)
+    n_groups = np.maximum((share*par.simN).astype(int),frac > 0)    # at least one agent in each populated cell
+    n_groups[np.argmax(share)] += par.simN-np.sum(n_groups)         # assure it sums to simN
+    return n_groups
+
+def pc_std(bins):
+    """ std. of the distributions in pc_sample (uniform between the bins) for each row of bins """
+    lo = bins[:,:-1]
+    hi = bins[:,1:]
+    mean = np.mean((lo+hi)/2,axis=1)
+    mean2 = np.mean((lo**2+lo*hi+hi**2)/3,axis=1)
+    return np.sqrt(np.maximum(mean2-mean**2,0))
+
+def pc_sample(N,percentiles,bins,u):
+    """ N samples from a dsitribution given its percentiles and bins and N uniform draws u (assumes equal spacing between percentiles)"""
     diff = np.diff(percentiles)
     assert np.allclose(diff[0],diff)
     n = int(N/diff.size)
-    draws = np.random.uniform(low=bins[:-1], high=bins[1:], size=(n,diff.size)).ravel()
-    return np.concatenate((draws, np.random.uniform(low=bins[0], high=bins[-1], size=(N-n*diff.size)))) # to assure we return N samples                        
+    K = n*diff.size
+    sample = (bins[:-1] + (bins[1:]-bins[:-1])*u[:K].reshape(n,diff.size)).ravel()
+    return np.concatenate((sample, bins[0] + (bins[-1]-bins[0])*u[K:])) # to assure we return N samples                        
 
 def adjust_pension(par,sim):
 
     # unpack 
     states = sim.states
+    w = sim.w
     priv_pension = np.array([par.priv_pension_female, par.priv_pension_male])
     
     # adjust pension
@@ -658,7 +924,7 @@ def adjust_pension(par,sim):
         idx_high = np.nonzero((states[:,0]==ma) & (np.isin(states[:,1], (1,3))))[0]            
             
         # adjust private pension
-        share = len(idx_high) / (len(idx_low) + len(idx_high))          # share of high skilled
+        share = np.sum(w[idx_high]) / (np.sum(w[idx_low]) + np.sum(w[idx_high]))    # share of high skilled
         pens_low = Xlow(par.g_adjust,share)*priv_pension[ma]
         pens_high = Xhigh(par.g_adjust,share)*priv_pension[ma]
         assert np.allclose(share*pens_high + (1-share)*pens_low, priv_pension[ma])
@@ -26,6 +26,11 @@ def fill_number(y_arr,idx,x):
     for i in range(idx.size):
         y_arr[idx[i]] = x        
 
+@njit(parallel=True)
+def tcol(x,t):
+    """ column of period t in the panel x (panels which are not in the outputs only keep the last two periods) """
+    return t % x.shape[1]
+
 ##################################
 ####         Singles         #####
 ##################################
@@ -35,7 +40,7 @@ def lifecycle(sim,sol,par):
 
     # unpack
     RA = sim.RA
-    alive = sim.alive
+    death = sim.death
     d = sim.d
 
     # states which are fixed (parallel outside loop)
@@ -53,11 +58,11 @@ def lifecycle(sim,sol,par):
             for ra in np.array([0,1,2]):
 
                 # indices
-                idx_alive = idx_st[(RA[idx_st]==ra) & (alive[idx_st,t]==1)]
+                idx_alive = idx_st[(RA[idx_st]==ra) & (death[idx_st] > t)]
                 
                 # simulate
                 for ds in [0,1]:
-                    idx = idx_alive[d[idx_alive,t]==ds]
+                    idx = idx_alive[d[idx_alive,tcol(d,t)]==ds]
                     simulate_single(t,ma,st,elig,ra,sim.c,sim.m,sim.a,sim.d,sim.probs,sim.RA,sim.GovS,sol,par,sim,idx,ds)
 
                     # euler errors
@@ -65,23 +70,23 @@ def lifecycle(sim,sol,par):
                         euler_error(t,ma,st,ra,sim.euler,sol,par,sim,idx,ds)                   
 
 @njit(parallel=True)
-def simulate_single(t,ma,st,elig,ra,c,m,a,d,probs,RA,GovS,sol,par,sim,idx,ds,ad=0,ad_min=0):
-    """ simulate single model (ad and ad_min are only so the couple model can look up in this function) """
+def simulate_single(t,ma,st,elig,ra,c,m,a,d,probs,RA,GovS,sol,par,sim,idx,ds,ad=0,ad_min=0,col=0):
+    """ simulate single model (ad, ad_min and col are only so the couple model can look up in this function) """
 
     if idx.size > 0:
 
         # update m and optimal choices
         if t > 0:   # m is initialized in 1. period
             update_m(t,ma,st,ra,ds,m,a,sim,par,idx,GovS,ad,ad_min)
-        c_interp,v_interp = ConsValue(t,ma,st,ra,ds,m,sol,par,idx,ad,ad_min)
-        optimal_choices(t,ds,c,d,probs,c_interp,v_interp,sim,par,idx,ad,ad_min)
+        c_interp,prob = ConsValue(t,ma,st,ra,ds,m,sol,par,idx,ad,ad_min)
+        optimal_choices(t,ds,c,d,probs,c_interp,prob,sim,par,idx,ad,ad_min,col)
 
         # only update retirement status if still working
         if ds == 1:
-            update_ra(t,elig,RA,par,idx)
+            update_ra(t+ad,elig,RA,par,idx)
         
         # update a
-        fill_arr(a[:,t],idx,m[idx,t]-c[idx,t])        
+        fill_arr(a[:,tcol(a,t)],idx,m[idx,tcol(m,t)]-c[idx,tcol(c,t)])        
 
 @njit(parallel=True)
 def update_ra(t,elig,RA,par,idx):
@@ -95,46 +100,50 @@ def update_ra(t,elig,RA,par,idx):
 
 @njit(parallel=True)
 def update_m(t,ma,st,ra,ds,m,a,sim,par,idx,GovS,ad=0,ad_min=0):
-    """ update m for singles """
+    """ update m for singles (ad and ad_min are only so the couple model can look up in this function) """
 
     # unpack
-    a_idx = sim.a[idx,t-1]
+    a_idx = sim.a[idx,tcol(sim.a,t-1)]
+    t_own = t+ad    # own time (only differs from t for widows)
 
     # working
     if ds == 1:
-        inc = sim.labor_post[idx,t+ad+ad_min,ma]
+        inc = sim.labor_post[idx,t_own+ad_min,ma]
 
     # retired
     elif ds == 0:
         shocks = np.ones(len(idx))
 
         # oap
-        if t >= par.T_oap:
-            pre = transitions.oap_pretax(t,par,i=0)[0]*shocks
-            inc = transitions.posttax(t,par,ds,inc=pre,inc_s=np.inf*shocks)  # set spouse inc to inf, so when we look up for couples (who are now singles) they can't share deduction
+        if t_own >= par.T_oap:
+            pre = transitions.oap_pretax(t_own,par,i=0)[0]*shocks
+            inc = transitions.posttax(t_own,par,ds,inc=pre,inc_s=np.inf*shocks,d_s=0)  # set spouse inc to inf, so when we look up for couples (who are now singles) they can't share deduction
 
         # erp
-        elif par.T_erp <= t < par.T_oap:
-            pre = transitions.erp_pretax(t,ma,st,ra,par)[0]*shocks
-            inc = transitions.posttax(t,par,ds,inc=pre,inc_s=np.inf*shocks)
+        elif par.T_erp <= t_own < par.T_oap:
+            pre = transitions.erp_pretax(t_own,ma,st,ra,par)[0]*shocks
+            inc = transitions.posttax(t_own,par,ds,inc=pre,inc_s=np.inf*shocks,d_s=0)
 
         else:
             pre = np.zeros(len(idx))
             inc = pre
 
     # update m
-    fill_arr(m[:,t],idx,par.R*a_idx[:] + inc[:])
+    fill_arr(m[:,tcol(m,t)],idx,par.R*a_idx[:] + inc[:])
 
     # government surplus
     if sim.tax:
         if ds == 1:
-            pre = sim.labor_pre[idx,t,ma]        
+            pre = sim.labor_pre[idx,t_own+ad_min,ma]        
         fill_arr(GovS[:,t],idx, ds*pre[:] - inc[:])     # working (ds=1): tax is pre-inc, 
                                                         # retired (ds=0): tax is -inc                    
 
 @njit(parallel=True)
 def ConsValue(t,ma,st,ra,ds,m,sol,par,idx,ad=0,ad_min=0):
-    """ interpolate consumption and value (ad and ad_min are only so the couple model can look up in this function) """
+    """ interpolate consumption and the retirement probability (ad and ad_min are only so the couple model can look up in this function) 
+    
+    the retirement probability is interpolated in sol.prob if par.sol_tables and else computed from the interpolated values
+    """
 
     # a. unpack solution
     ad_idx = ad+ad_min    
@@ -148,72 +157,75 @@ def ConsValue(t,ma,st,ra,ds,m,sol,par,idx,ad=0,ad_min=0):
     prep = linear_interp.interp_1d_prep(idx.size)
     c_interp = np.zeros((idx.size,D.size)) # note c_interp and v_interp are transposed of each other
     v_interp = np.zeros((D.size,idx.size))
+    prob = np.zeros(idx.size)
 
     # b. sort m (so interp is faster)
-    idx_unsort = np.argsort(np.argsort(m[idx,t])) # index to unsort 
-    m_sort = np.sort(m[idx,t])
+    idx_unsort = np.argsort(np.argsort(m[idx,tcol(m,t)])) # index to unsort 
+    m_sort = np.sort(m[idx,tcol(m,t)])
 
     # c. interpolate and sort back
-    if ds == 1:
-        for d in D:
-            linear_interp.interp_1d_vec_mon(prep,m_sol[:],c_sol[d],m_sort,c_interp[:,d])        
-            linear_interp.interp_1d_vec_mon(prep,m_sol[:],v_sol[d],m_sort,v_interp[d])         
-
-        # sort back
-        c_interp = c_interp[idx_unsort]
-        v_interp = v_interp[:,idx_unsort]
+    for d in D:
+        linear_interp.interp_1d_vec_mon(prep,m_sol[:],c_sol[d],m_sort,c_interp[:,d])
+    c_interp = c_interp[idx_unsort]
 
-    elif ds == 0:
-        for d in D:
-            linear_interp.interp_1d_vec_mon(prep,m_sol[:],c_sol[d],m_sort,c_interp[:,d])            
-
-        # sort back
-        c_interp = c_interp[idx_unsort]
+    # d. retirement probability (only if there is a choice)
+    if ds == 1:
+        if D.size == 1:
+            prob[:] = 1
+        elif par.sol_tables:
+            linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],sol.prob[t+ad_idx,ma,st,ra_look],m_sort,prob)
+            prob = prob[idx_unsort]
+        else:
+            for d in D:
+                linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],v_sol[d],m_sort,v_interp[d])
+            prob = funs.logsum2(v_interp[:,idx_unsort],par)[1][0] # probs are in 1 and retirement probs are in 0 
 
-    # d. return
-    return c_interp,v_interp
+    # e. return
+    return c_interp,prob
 
 @njit(parallel=True)
-def optimal_choices(t,ds,c,d,probs,c_interp,v_interp,sim,par,idx,ad=0,ad_min=0):
-    """ find optimal consumption and retirement choice (ad and ad_min are only so the couple model can look up in this function)"""
+def optimal_choices(t,ds,c,d,probs,c_interp,prob,sim,par,idx,ad=0,ad_min=0,col=0):
+    """ find optimal consumption and retirement choice (ad, ad_min and col are only so the couple model can look up in this function)"""
 
     # unpack
     t_idx = t + 1 + ad + ad_min
-    choiceP = sim.choiceP[idx,t_idx-1,0]
+    choiceP = sim.choiceP[idx,t_idx-1,col]
+    tc = tcol(c,t)
+    td = tcol(d,t_idx)
+    tp = tcol(probs,t_idx)
 
     # working
     if ds == 1:
         
-        # a. retirement prob and optimal labor choice
-        prob = funs.logsum2(v_interp,par)[1][0] # probs are in 1 and retirement probs are in 0 
+        # a. optimal labor choice
         work_choice = (prob <= choiceP[:])
         work_idx = idx[work_choice]
         ret_idx = idx[~work_choice]
 
         # b. optimal choices
-        if t+1 < par.Tr-1:
-            fill_arr(c[:,t],work_idx,c_interp[work_choice,1])
-            fill_arr(c[:,t],ret_idx,c_interp[~work_choice,0])            
+        if t+1+ad < par.Tr-1:
+            fill_arr(c[:,tc],work_idx,c_interp[work_choice,1])
+            fill_arr(c[:,tc],ret_idx,c_interp[~work_choice,0])            
         else:
-            fill_arr(c[:,t],idx,c_interp[:,0])
+            fill_arr(c[:,tc],idx,c_interp[:,0])
 
         if t+1 < par.simT:
-            if t+1 < par.Tr-1:
-                fill_number(d[:,t_idx],work_idx,1)
-                fill_number(d[:,t_idx],ret_idx,0)  
-                fill_arr(probs[:,t_idx],idx,prob)
+            if t+1+ad < par.Tr-1:
+                fill_number(d[:,td],work_idx,1)
+                fill_number(d[:,td],ret_idx,0)  
+                fill_arr(probs[:,tp],idx,prob)
             else:
-                fill_number(d[:,t_idx],idx,0)
-                fill_number(probs[:,t_idx],idx,1)
+                fill_number(d[:,td],idx,0)
+                fill_number(probs[:,tp],idx,1)
     
     # retired
     elif ds == 0:
 
         # a. optimal choices
-        fill_arr(c[:,t],idx,c_interp[:,0])
+        fill_arr(c[:,tc],idx,c_interp[:,0])
         if t+1 < par.simT:
-            fill_number(d[:,t_idx],idx,0)
-            fill_number(probs[:,t_idx],idx,0)   
+            fill_number(d[:,td],idx,0)
+            fill_number(probs[:,tp],idx,0)   
 
 @njit(parallel=True)
 def euler_error(t,ma,st,ra,euler,sol,par,sim,idx,ds):
@@ -225,9 +237,9 @@ def euler_error(t,ma,st,ra,euler,sol,par,sim,idx,ds):
         sol_m = sol.m[:]
         sol_c = sol.c[:,ma,st]
         sol_v = sol.v[:,ma,st]
-        c = sim.c[:,t]
-        m = sim.m[:,t]
-        a = sim.a[:,t]
+        c = sim.c[:,tcol(sim.c,t)]
+        m = sim.m[:,tcol(sim.m,t)]
+        a = sim.a[:,tcol(sim.a,t)]
         tol = par.tol
         pi_plus = transitions.survival_lookup_single(t+1,ma,st,par)    
 
@@ -250,15 +262,15 @@ def euler_error(t,ma,st,ra,euler,sol,par,sim,idx,ds):
 
 @njit(parallel=True)
 def lifecycle_c(sim,sol,single_sol,par,single_par):
-    """ simulate couple model """
+    """ simulate couple model (and widows/widowers on the single solution if sim.widow) """
 
     # unpack
     d_w = sim.d[:,:,0]
     d_h = sim.d[:,:,1]
     RA_w = sim.RA[:,0]
     RA_h = sim.RA[:,1]
-    alive_w = sim.alive[:,:,0]
-    alive_h = sim.alive[:,:,1]    
+    death_w = sim.death[:,0]
+    death_h = sim.death[:,1]    
     probs_w = sim.probs[:,:,0]
     probs_h = sim.probs[:,:,1]
 
@@ -275,50 +287,62 @@ def lifecycle_c(sim,sol,single_sol,par,single_par):
         elig_h = transitions.state_translate(st_h,'elig',par)
         elig_w = transitions.state_translate(st_w,'elig',par)        
 
+        # households where both are alive and survivors (widowers and widows)
+        idx_c = idx_st
+        idx_h = np.zeros(0,dtype=idx_st.dtype)
+        idx_w = np.zeros(0,dtype=idx_st.dtype)
+
         for t in range(par.simT):
             tw_idx = t+ad+par.ad_min
             th_idx = t+par.ad_min
 
             # initialize d
             if t == 0:
-                d_w[idx_st,tw_idx] = 1
-                d_h[idx_st,th_idx] = 1
-
-            # loop over retirement status
+                d_w[idx_st,tcol(d_w,tw_idx)] = 1
+                d_h[idx_st,tcol(d_h,th_idx)] = 1
+
+            # a. widowhood (move newly single survivors from the couples to the survivors)
+            al_h = death_h[idx_c] > th_idx
+            al_w = death_w[idx_c] > tw_idx
+            if sim.widow:
+                idx_h = np.concatenate((idx_h[death_h[idx_h] > th_idx], idx_c[al_h & ~al_w]))
+                idx_w = np.concatenate((idx_w[death_w[idx_w] > tw_idx], idx_c[~al_h & al_w]))
+            idx_c = idx_c[al_h & al_w]
+
+            # b. couples: loop over retirement status
             for ra_h in np.array([0,1,2]):
                 for ra_w in np.array([0,1,2]):
-                    idx_ra = idx_st[(RA_h[idx_st]==ra_h) & (RA_w[idx_st]==ra_w)]
-                        
-                    # loop over alive status
-                    for al_h in [0,1]:
-                        for al_w in [0,1]:
-
-                            # only simulate if at least one in the household is alive
-                            if al_h == 1 or al_w == 1:
-                                idx_alive = idx_ra[(alive_h[idx_ra,th_idx]==al_h) & (alive_w[idx_ra,tw_idx]==al_w)]
-
-                                # loop over labor market status
-                                for dh in [0,1]:
-                                    for dw in [0,1]:
-                                                
-                                        # if both are alive we get 4 slices (4 different labor market status)
-                                        if al_h == 1 and al_w == 1:
-                                            idx = idx_alive[(d_h[idx_alive,th_idx]==dh) & (d_w[idx_alive,tw_idx]==dw)]
-                                            simulate_couple(t,ad,st_h,st_w,elig_h,elig_w,ra_h,ra_w,sim.c,sim.m,sim.a,d_h,d_w,probs_h,probs_w,RA_h,RA_w,sim.GovS,
-                                                            sol,single_sol,par,single_par,sim,
-                                                            idx,dh,dw)
-
-                                        # # if only husband is alive we get 2 slices (2 different labor market status)
-                                        # elif al_h == 1:
-                                        #     idx = idx_alive[(d_h[idx_alive,th_idx]==dh)]
-                                        #     simulate_single(t,1,st_h,elig_h,ra_h,sim.c,sim.m,sim.a,d_h,probs_h,RA_h,sim.GovS,single_sol,par,sim,
-                                        #                     idx,dh,ad=0,ad_min=par.ad_min)
-
-                                        # # if only wife is alive we get 2 slices (2 different labor market status)
-                                        # elif al_w == 1:
-                                        #     idx = idx_alive[(d_w[idx_alive,tw_idx]==dw)]
-                                        #     simulate_single(t,0,st_w,elig_w,ra_w,sim.c,sim.m,sim.a,d_w,probs_w,RA_w,sim.GovS,single_sol,par,sim,
-                                        #                     idx,dw,ad=ad,ad_min=par.ad_min)
+                    idx_ra = idx_c[(RA_h[idx_c]==ra_h) & (RA_w[idx_c]==ra_w)]
+
+                    # loop over labor market status (4 slices)
+                    for dh in [0,1]:
+                        for dw in [0,1]:
+                            idx = idx_ra[(d_h[idx_ra,tcol(d_h,th_idx)]==dh) & (d_w[idx_ra,tcol(d_w,tw_idx)]==dw)]
+                            simulate_couple(t,ad,st_h,st_w,elig_h,elig_w,ra_h,ra_w,sim.c,sim.m,sim.a,d_h,d_w,probs_h,probs_w,RA_h,RA_w,sim.GovS,
+                                            sol,single_sol,par,single_par,sim,
+                                            idx,dh,dw)
+
+            # c. survivors: simulated on the single solution with their own time (t+ad)
+            if sim.widow:
+                simulate_widow(t,1,st_h,elig_h,0,sim.c,sim.m,sim.a,d_h,probs_h,RA_h,sim.GovS,single_sol,par,sim,idx_h)
+                simulate_widow(t,0,st_w,elig_w,ad,sim.c,sim.m,sim.a,d_w,probs_w,RA_w,sim.GovS,single_sol,par,sim,idx_w)
+
+@njit(parallel=True)
+def simulate_widow(t,ma,st,elig,ad,c,m,a,d,probs,RA,GovS,single_sol,par,sim,idx):
+    """ simulate surviving spouses (ma=1: widowers, ma=0: widows) in the couple model on the single solution """
+
+    if idx.size > 0:
+
+        # own time index in the extended couple arrays
+        t_idx = t+ad+par.ad_min
+
+        # loop over retirement status and labor market status (2 slices)
+        for ra in np.array([0,1,2]):
+            idx_ra = idx[RA[idx]==ra]
+            for ds in [0,1]:
+                idx_d = idx_ra[d[idx_ra,tcol(d,t_idx)]==ds]
+                simulate_single(t,ma,st,elig,ra,c,m,a,d,probs,RA,GovS,single_sol,par,sim,
+                                idx_d,ds,ad=ad,ad_min=par.ad_min,col=ma)
 
 @njit(parallel=True)
 def simulate_couple(t,ad,st_h,st_w,elig_h,elig_w,ra_h,ra_w,c,m,a,d_h,d_w,probs_h,probs_w,RA_h,RA_w,GovS,
@@ -328,14 +352,14 @@ def simulate_couple(t,ad,st_h,st_w,elig_h,elig_w,ra_h,ra_w,c,m,a,d_h,d_w,probs_h
     if idx.size > 0:
         if t > 0:
             update_m_c(t,ad,st_h,st_w,ra_h,ra_w,dh,dw,m,sim,par,idx,GovS)        
-        c_interp,v_interp = ConsValue_c(t,ad,st_h,st_w,ra_h,ra_w,dh,dw,m,sol,par,idx)
-        optimal_choices_c(t,ad,dh,dw,c,d_h,d_w,probs_h,probs_w,c_interp,v_interp,sim,par,idx)
+        c_interp,prob_h,prob_w = ConsValue_c(t,ad,st_h,st_w,ra_h,ra_w,dh,dw,m,sol,par,idx)
+        optimal_choices_c(t,ad,dh,dw,c,d_h,d_w,probs_h,probs_w,c_interp,prob_h,prob_w,sim,par,idx)
         if dh == 1:
             update_ra(t,elig_h,RA_h,par,idx)
         if dw == 1:
             update_ra(t+ad,elig_w,RA_w,par,idx) 
 
-        fill_arr(a[:,t],idx,m[idx,t]-c[idx,t])                                     
+        fill_arr(a[:,tcol(a,t)],idx,m[idx,tcol(m,t)]-c[idx,tcol(c,t)])                                     
 
 @njit(parallel=True)
 def update_m_c(t,ad,st_h,st_w,ra_h,ra_w,d_h,d_w,m,sim,par,idx,GovS):
@@ -343,7 +367,7 @@ def update_m_c(t,ad,st_h,st_w,ra_h,ra_w,d_h,d_w,m,sim,par,idx,GovS):
 
     # unpack
     ad_min = par.ad_min
-    a = sim.a[idx,t-1]
+    a = sim.a[idx,tcol(sim.a,t-1)]
 
     # both working
     if d_h == 1 and d_w == 1:
@@ -399,7 +423,7 @@ def update_m_c(t,ad,st_h,st_w,ra_h,ra_w,d_h,d_w,m,sim,par,idx,GovS):
                transitions.posttax(t+ad,par,d_w,inc=pre_w,inc_s=pre_h,d_s=d_h,t_s=t))
 
     # update m
-    fill_arr(m[:,t],idx,par.R*a[:] + inc[:])
+    fill_arr(m[:,tcol(m,t)],idx,par.R*a[:] + inc[:])
 
     # government surplus
     if sim.tax:
@@ -411,7 +435,10 @@ def update_m_c(t,ad,st_h,st_w,ra_h,ra_w,d_h,d_w,m,sim,par,idx,GovS):
 
 @njit(parallel=True)
 def ConsValue_c(t,ad,st_h,st_w,ra_h,ra_w,d_h,d_w,m,sol,par,idx):
-    """ interpolate consumption and value for couple model """
+    """ interpolate consumption and the retirement probabilities of the working spouses for couple model 
+    
+    the retirement probabilities are interpolated in sol.prob if par.sol_tables and else computed from the interpolated values
+    """
 
     # a. unpack solution
     D = transitions.d_plus_c(t-1,ad,d_h,d_w,par)    # t-1 so we get choice set today
@@ -426,33 +453,45 @@ def ConsValue_c(t,ad,st_h,st_w,ra_h,ra_w,d_h,d_w,m,sol,par,idx):
     prep = linear_interp.interp_1d_prep(idx.size)
     c_interp = np.zeros((idx.size,4))   # note c_interp and v_interp are transposed of each other
     v_interp = np.zeros((4,idx.size)) 
+    prob_h = np.zeros(idx.size)
+    prob_w = np.zeros(idx.size)
 
     # b. sort m (so interp is faster)
-    idx_unsort = np.argsort(np.argsort(m[idx,t])) # index to unsort 
-    m_sort = np.sort(m[idx,t])                
+    idx_unsort = np.argsort(np.argsort(m[idx,tcol(m,t)])) # index to unsort 
+    m_sort = np.sort(m[idx,tcol(m,t)])                
 
     # c. interpolate and sort back
-    if d_h == 0 and d_w == 0:
-        for d in D:
-            linear_interp.interp_1d_vec_mon(prep,m_sol[:],c_sol[d],m_sort,c_interp[:,d])        
+    for d in D:
+        linear_interp.interp_1d_vec_mon(prep,m_sol[:],c_sol[d],m_sort,c_interp[:,d])        
+    c_interp = c_interp[idx_unsort]
 
-        # sort back
-        c_interp = c_interp[idx_unsort]
-
-    else:
+    # d. retirement probabilities (if someone is working)
+    if par.sol_tables:
+        prob_sol = sol.prob[t,ad_idx,st_h,st_w,ra_look_h,ra_look_w]
+        if d_h == 1 and d_w == 1:
+            linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],prob_sol[0],m_sort,prob_h)
+            linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],prob_sol[1],m_sort,prob_w)
+        elif d_h == 1:
+            linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],prob_sol[2],m_sort,prob_h)
+        elif d_w == 1:
+            linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],prob_sol[3],m_sort,prob_w)
+        prob_h = prob_h[idx_unsort]
+        prob_w = prob_w[idx_unsort]
+
+    elif d_h == 1 or d_w == 1:
         for d in D:
-            linear_interp.interp_1d_vec_mon(prep,m_sol[:],c_sol[d],m_sort,c_interp[:,d])        
-            linear_interp.interp_1d_vec_mon(prep,m_sol[:],v_sol[d],m_sort,v_interp[d])         
-
-        # sort back
-        c_interp = c_interp[idx_unsort]
-        v_interp = v_interp[:,idx_unsort]    
+            linear_interp.interp_1d_vec_mon_rep(prep,m_sol[:],v_sol[d],m_sort,v_interp[d])         
+        prob = funs.logsum4(v_interp[:,idx_unsort],par)[1]
+        if d_h == 1:
+            prob_h = prob[0] + prob[1]
+        if d_w == 1:
+            prob_w = prob[0] + prob[2]
     
-    # d. return
-    return c_interp,v_interp
+    # e. return
+    return c_interp,prob_h,prob_w
 
 @njit(parallel=True)
-def optimal_choices_c(t,ad,dh_t,dw_t,c,d_h,d_w,probs_h,probs_w,c_interp,v_interp,sim,par,idx):
+def optimal_choices_c(t,ad,dh_t,dw_t,c,d_h,d_w,probs_h,probs_w,c_interp,prob_h,prob_w,sim,par,idx):
     """ optimal choices for couples """
 
     # unpack
@@ -460,14 +499,16 @@ def optimal_choices_c(t,ad,dh_t,dw_t,c,d_h,d_w,probs_h,probs_w,c_interp,v_interp
     tw_idx = t + 1 + ad + par.ad_min
     choiceP_w = sim.choiceP[idx,th_idx-1,0]
     choiceP_h = sim.choiceP[idx,tw_idx-1,1]    
+    tc = tcol(c,t)
+    th_d = tcol(d_h,th_idx)
+    tw_d = tcol(d_w,tw_idx)
+    th_p = tcol(probs_h,th_idx)
+    tw_p = tcol(probs_w,tw_idx)
 
     # both work
     if dh_t == 1 and dw_t == 1:
 
-        # retirement probs and choices
-        prob = funs.logsum4(v_interp,par)[1]
-        prob_w = prob[0] + prob[2]
-        prob_h = prob[0] + prob[1]
+        # retirement choices
         work_choice_w = (prob_w <= choiceP_w[:])
         work_choice_h = (prob_h <= choiceP_h[:])
         work_idx_w = idx[work_choice_w]
@@ -480,28 +521,26 @@ def optimal_choices_c(t,ad,dh_t,dw_t,c,d_h,d_w,probs_h,probs_w,c_interp,v_interp
 
             # husband
             if t+1 < par.Tr-1:
-                fill_number(d_h[:,th_idx],work_idx_h,1)
-                fill_number(d_h[:,th_idx],ret_idx_h,0)
-                fill_arr(probs_h[:,th_idx],idx,prob_h)
+                fill_number(d_h[:,th_d],work_idx_h,1)
+                fill_number(d_h[:,th_d],ret_idx_h,0)
+                fill_arr(probs_h[:,th_p],idx,prob_h)
             else:
-                fill_number(d_h[:,th_idx],idx,0)
-                fill_number(probs_h[:,th_idx],idx,1)
+                fill_number(d_h[:,th_d],idx,0)
+                fill_number(probs_h[:,th_p],idx,1)
 
             # wife
             if t+1+ad < par.Tr-1:            
-                fill_number(d_w[:,tw_idx],work_idx_w,1)
-                fill_number(d_w[:,tw_idx],ret_idx_w,0)
-                fill_arr(probs_w[:,tw_idx],idx,prob_w)
+                fill_number(d_w[:,tw_d],work_idx_w,1)
+                fill_number(d_w[:,tw_d],ret_idx_w,0)
+                fill_arr(probs_w[:,tw_p],idx,prob_w)
             else:
-                fill_number(d_w[:,tw_idx],idx,0)          
-                fill_number(probs_w[:,tw_idx],idx,1)         
+                fill_number(d_w[:,tw_d],idx,0)          
+                fill_number(probs_w[:,tw_p],idx,1)         
 
     # husband work
     if dh_t == 1 and dw_t == 0:
 
-        # retirement probs and choices
-        prob = funs.logsum4(v_interp,par)[1]
-        prob_h = prob[0] + prob[1]
+        # retirement choices
         work_choice_h = ((prob_h <= choiceP_h[:]))
         work_idx_h = idx[work_choice_h]
         ret_idx_h = idx[~work_choice_h]        
@@ -511,23 +550,21 @@ def optimal_choices_c(t,ad,dh_t,dw_t,c,d_h,d_w,probs_h,probs_w,c_interp,v_interp
             
             # husband
             if t+1 < par.Tr-1:
-                fill_number(d_h[:,th_idx],work_idx_h,1)
-                fill_number(d_h[:,th_idx],ret_idx_h,0)
-                fill_arr(probs_h[:,th_idx],idx,prob_h)
+                fill_number(d_h[:,th_d],work_idx_h,1)
+                fill_number(d_h[:,th_d],ret_idx_h,0)
+                fill_arr(probs_h[:,th_p],idx,prob_h)
             else:
-                fill_number(d_h[:,th_idx],idx,0)
-                fill_number(probs_h[:,th_idx],idx,1)
+                fill_number(d_h[:,th_d],idx,0)
+                fill_number(probs_h[:,th_p],idx,1)
 
             # wife
-            fill_number(d_w[:,tw_idx],idx,0)
-            fill_number(probs_w[:,tw_idx],idx,0)
+            fill_number(d_w[:,tw_d],idx,0)
+            fill_number(probs_w[:,tw_p],idx,0)
 
     # wife work
     if dh_t == 0 and dw_t == 1:
 
-        # retirement probs and choices
-        prob = funs.logsum4(v_interp,par)[1]
-        prob_w = prob[0] + prob[2]
+        # retirement choices
         work_choice_w = ((prob_w <= choiceP_w[:]))
         work_idx_w = idx[work_choice_w]
         ret_idx_w = idx[~work_choice_w]
@@ -537,38 +574,38 @@ def optimal_choices_c(t,ad,dh_t,dw_t,c,d_h,d_w,probs_h,probs_w,c_interp,v_interp
             
             # wife
             if t+1+ad < par.Tr-1:            
-                fill_number(d_w[:,tw_idx],work_idx_w,1)
-                fill_number(d_w[:,tw_idx],ret_idx_w,0)         
-                fill_arr(probs_w[:,tw_idx],idx,prob_w)
+                fill_number(d_w[:,tw_d],work_idx_w,1)
+                fill_number(d_w[:,tw_d],ret_idx_w,0)         
+                fill_arr(probs_w[:,tw_p],idx,prob_w)
             else:
-                fill_number(d_w[:,tw_idx],idx,0) 
-                fill_number(probs_w[:,tw_idx],idx,1)           
+                fill_number(d_w[:,tw_d],idx,0) 
+                fill_number(probs_w[:,tw_p],idx,1)           
 
             # wife
-            fill_number(d_h[:,th_idx],idx,0)
-            fill_number(probs_h[:,th_idx],idx,0)
+            fill_number(d_h[:,th_d],idx,0)
+            fill_number(probs_h[:,th_p],idx,0)
 
     # both retired
     if dh_t == 0 and dw_t == 0:
         if t+1 < par.simT:
             
             # husband
-            fill_number(d_h[:,th_idx],idx,0)
-            fill_number(probs_h[:,th_idx],idx,0)
+            fill_number(d_h[:,th_d],idx,0)
+            fill_number(probs_h[:,th_p],idx,0)
 
             # wife
-            fill_number(d_w[:,tw_idx],idx,0)            
-            fill_number(probs_w[:,tw_idx],idx,0)
+            fill_number(d_w[:,tw_d],idx,0)            
+            fill_number(probs_w[:,tw_p],idx,0)
 
     # optimal consumption
     if t+1 < par.simT:
-        dw = d_w[idx,tw_idx]
-        dh = d_h[idx,th_idx]
+        dw = d_w[idx,tw_d]
+        dh = d_h[idx,th_d]
         d0 = ((dh == 0) & (dw == 0))
         d1 = ((dh == 0) & (dw == 1))
         d2 = ((dh == 1) & (dw == 0))
         d3 = ((dh == 1) & (dw == 1))
-        fill_arr(c[:,t],idx[d0],c_interp[:,0])
-        fill_arr(c[:,t],idx[d1],c_interp[:,1])
-        fill_arr(c[:,t],idx[d2],c_interp[:,2])
-        fill_arr(c[:,t],idx[d3],c_interp[:,3])
\ No newline at end of file
+        fill_arr(c[:,tc],idx[d0],c_interp[:,0])
+        fill_arr(c[:,tc],idx[d1],c_interp[:,1])
+        fill_arr(c[:,tc],idx[d2],c_interp[:,2])
+        fill_arr(c[:,tc],idx[d3],c_interp[:,3])
\ No newline at end of file
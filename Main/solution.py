@@ -214,4 +214,63 @@ def solve_couple_model(ad,st_h,st_w,par,a,
                     D_w = np.array([0,1])
                     egm.solve_bellman_c(t,ad,st_h,st_w,ra_h,ra_w,D_h,D_w,par,a,
                                         sol_c,sol_m,sol_v,
-                                        single_sol_v_plus_raw,single_sol_avg_marg_u_plus) 
\ No newline at end of file
+                                        single_sol_v_plus_raw,single_sol_avg_marg_u_plus)
+
+@njit(parallel=True)
+def tables(sol,par):
+    """ retirement probabilities on the grid for the single model (interpolated in the simulation if par.sol_tables) """
+
+    it = par.iterator
+    for j in prange(len(it)):
+        ma = it[j,0]
+        st = it[j,1]
+        for t in range(par.T):
+            for ra in range(3):
+                if not np.isnan(sol.v[t,ma,st,ra,1,0]):    # only where working is solved
+                    sol.prob[t,ma,st,ra] = funs.logsum2(sol.v[t,ma,st,ra],par)[1][0]
+
+@njit(parallel=True)
+def tables_c(sol,par):
+    """ retirement probabilities on the grid for the couple model (interpolated in the simulation if par.sol_tables)
+    
+    the choice sets follow simulate.ConsValue_c and the tables are 0: husband and 1: wife if both work,
+    2: husband if only he works and 3: wife if only she works
+    """
+
+    Na = len(sol.m)
+    it = par.iterator
+    for j in prange(len(it)):
+        ad = it[j,0]
+        st_h = it[j,1]
+        st_w = it[j,2]
+        ad_idx = ad+par.ad_min
+        for t in range(par.T):
+            for ra_h in range(3):
+                for ra_w in range(3):
+                    v_sol = sol.v[t,ad_idx,st_h,st_w,ra_h,ra_w]
+                    prob = sol.prob[t,ad_idx,st_h,st_w,ra_h,ra_w]
+                    for k in range(3):
+                        d_h = 1
+                        d_w = 1
+                        if k == 1:
+                            d_w = 0
+                        elif k == 2:
+                            d_h = 0
+
+                        # choice specific values (zero outside the choice set)
+                        D = transitions.d_plus_c(t-1,ad,d_h,d_w,par)    # t-1 so we get choice set today
+                        if D.size == 1 or np.isnan(v_sol[D[-1],0]):    # no choice or not solved
+                            continue
+                        v = np.zeros((4,Na))
+                        for d in D:
+                            v[d] = v_sol[d]
+                        p = funs.logsum4(v,par)[1]
+
+                        # retirement probabilities
+                        if k == 0:
+                            prob[0] = p[0] + p[1]
+                            prob[1] = p[0] + p[2]
+                        elif k == 1:
+                            prob[2] = p[0] + p[1]
+                        else:
+                            prob[3] = p[0] + p[2]
@@ -0,0 +1,277 @@
+# global modules
+import os
+import json
+import numpy as np
+
+# local modules
+import funs
+
+# compact dtypes on disk (money and probabilities in single precision, choices and states in bytes)
+DTYPES = {'c': np.float32, 'a': np.float32, 'm': np.float32, 'GovS': np.float32,
+          'probs': np.float32, 'd': np.int8, 'alive': np.bool_, 'RA': np.uint8}
+PANELS = ('c', 'a', 'm', 'd', 'probs', 'GovS', 'alive')
+
+def single_path(path):
+    """ path for the single model of a couple store """
+    root,ext = os.path.splitext(path)
+    return root + '_single' + ext
+
+def memmap(scratch,name,shape,dtype,fill):
+    """ panel backed by a file in the scratch directory instead of memory
+
+    Args:
+        scratch (str): directory for the files
+        name (str): name of the file
+        shape (tuple): shape of the panel (agents first, time second)
+        dtype (numpy.dtype): type of the panel
+        fill (float): initial value
+
+    The panel is stored in Fortran order, so all agents in a period are next to each other on disk. The simulation
+    runs forward in time, so pages are written (and flushed by the OS) sequentially.
+    """
+
+    os.makedirs(scratch,exist_ok=True)
+    x = np.memmap(os.path.join(scratch,name+'.dat'),dtype=dtype,mode='w+',shape=shape,order='F')
+    x[:] = fill
+    return x
+
+def load_tables(path,par):
+    """ set the precomputed tables in par from the cache file path (returns False if it does not exist) """
+
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as f:
+        for name in f.files:
+            setattr(par,name,f[name])
+    return True
+
+def save_tables(path,par,names):
+    """ write the precomputed tables names in par to the cache file path (names not in par are skipped) """
+
+    os.makedirs(os.path.dirname(path) or '.',exist_ok=True)
+    tmp = path + '.tmp.npz'    # write and rename, so parallel runs never read a half written file
+    np.savez(tmp,**{name: getattr(par,name) for name in names if hasattr(par,name)})
+    os.replace(tmp,path)
+
+def save(model,path,chunk=int(1e5),compression='zstd'):
+    """ write the simulated panels of a model (and its single model) to a columnar parquet store
+
+    Args:
+        model (class): solved and simulated model
+        path (str): file to write
+        chunk (int): number of agents in each row group
+        compression (str): parquet compression codec
+
+    Columns are named var_age (singles) or var_w_age and var_h_age (couples), so downstream tools
+    can read only the variables and ages they need. Statistics per column are stored in the metadata.
+    """
+
+    write(model,path,chunk,compression)
+    if model.couple:
+        write(model.Single,single_path(path),chunk,compression)
+
+def write(model,path,chunk=int(1e5),compression='zstd'):
+    """ write simulated panels of one model to parquet """
+
+    # optional dependency
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # unpack
+    sim = model.sim
+    par = model.par
+    simN = par.simN
+
+    # columns (name, array, time index, agents index)
+    columns = cols(model)
+
+    # statistics and metadata
+    stats = {}
+    for name,arr,j,k in columns:
+        x = col_values(arr,j,k)
+        null = nulls(name,x)
+        x = x[~null]
+        stats[name] = {'null': int(np.sum(null)),
+                       'mean': float(np.mean(x)) if x.size > 0 else None,
+                       'min': float(np.min(x)) if x.size > 0 else None,
+                       'max': float(np.max(x)) if x.size > 0 else None}
+    meta = {'name': model.name, 'couple': bool(model.couple), 'simN': int(simN),
+            'start_T': int(par.start_T), 'simT': int(par.simT), 'ad_min': int(par.ad_min), 'ad_max': int(par.ad_max),
+            'stats': stats}
+
+    # write in chunks of agents (one row group per chunk)
+    writer = None
+    for i0 in range(0,simN,chunk):
+        rows = slice(i0,min(i0+chunk,simN))
+        arrays = []
+        names = []
+        for name,arr,j,k in columns:
+            x = col_values(arr,j,k)[rows]
+            dtype = DTYPES.get(var_name(name),x.dtype)
+            null = nulls(name,x)
+            if np.any(null) and np.dtype(dtype).kind != 'f':
+                x = np.where(null,0,x).astype(dtype)
+                arrays.append(pa.array(x,mask=null))
+            else:
+                arrays.append(pa.array(x.astype(dtype)))
+            names.append(name)
+        table = pa.Table.from_arrays(arrays,names=names)
+        if writer is None:
+            schema = table.schema.with_metadata({'sim': json.dumps(meta)})
+            writer = pq.ParquetWriter(path,schema,compression=compression,write_statistics=True)
+        writer.write_table(table)
+    writer.close()
+
+def cols(model):
+    """ list of columns as (name, array, time index, spouse index) """
+
+    # unpack
+    sim = model.sim
+    par = model.par
+
+    # id and states
+    columns = [('id',np.arange(par.simN,dtype=np.int32),None,None)]
+    if model.couple:
+        state_names = ('ad','st_h','st_w')
+    else:
+        state_names = ('ma','st')
+    for i in range(len(state_names)):
+        columns.append((state_names[i],sim.states.astype(np.int8),i,None))
+
+    # retirement status
+    if model.couple:
+        columns.append(('RA_w',sim.RA,0,None))
+        columns.append(('RA_h',sim.RA,1,None))
+    else:
+        columns.append(('RA',sim.RA,None,None))
+
+    # population weights
+    columns.append(('w',sim.w,None,None))
+
+    # panels (only those which are kept in the simulation)
+    for var in PANELS:
+        if var == 'alive':
+            arr = funs.panel(sim,var).astype(np.bool_)
+        else:
+            arr = getattr(sim,var)
+        if arr.shape[1] < par.simT:
+            continue
+        if arr.ndim == 2:
+            start = col_ages(par,arr.shape[1])[0]
+            for j in range(arr.shape[1]):
+                columns.append((f'{var}_{start+j}',arr,j,None))
+        else:
+            start = col_ages(par,arr.shape[1])[0]
+            for k,sex in ((0,'w'),(1,'h')):
+                for j in range(arr.shape[1]):
+                    columns.append((f'{var}_{sex}_{start+j}',arr,j,k))
+
+    return columns
+
+def col_ages(par,T):
+    """ ages of the T time columns of a panel (extended panels start ad_min periods earlier) """
+    start = par.start_T
+    if T > par.simT:
+        start = start - par.ad_min
+    return np.arange(start,start+T)
+
+def col_values(arr,j,k):
+    """ extract column from a panel """
+    if j is None:
+        return arr
+    elif k is None:
+        return arr[:,j]
+    else:
+        return arr[:,j,k]
+
+def nulls(col,x):
+    """ mask of missing values in a column (nan or -1 for d) """
+    if x.dtype.kind == 'f':
+        return np.isnan(x)
+    elif var_name(col) == 'd':
+        return x < 0
+    else:
+        return np.zeros(x.shape,dtype=bool)
+
+def var_name(col):
+    """ variable name of a column """
+    name = col.split('_')[0]
+    if col.startswith('RA'):
+        return 'RA'
+    return name
+
+def load(path,vars=['d','probs'],ages=None,sex=('w','h'),states=True):
+    """ read selected variables and ages from a parquet store
+
+    Args:
+        path (str): file to read
+        vars (list): variables to read
+        ages (list): first and last age to read (all if None)
+        sex (tuple): spouses to read for couples ('w' and/or 'h')
+        states (bool): also read the states (and population weights) of the agents
+
+    Returns:
+        out (dict): arrays of shape (agents, ages) or (agents, ages, spouses), nan where missing
+    """
+
+    # optional dependency
+    import pyarrow.parquet as pq
+
+    # select columns
+    schema = pq.read_schema(path)
+    meta = json.loads(schema.metadata[b'sim'])
+    names = schema.names
+    out = {}
+    select = []
+    for var in vars:
+        if meta['couple'] and var not in ('c','a','m','GovS'):
+            prefixes = [f'{var}_{s}_' for s in sex]
+        else:
+            prefixes = [f'{var}_']
+        for prefix in prefixes:
+            for name in names:
+                if name.startswith(prefix) and name[len(prefix):].isdigit():
+                    age = int(name[len(prefix):])
+                    if ages is None or ages[0] <= age <= ages[1]:
+                        select.append(name)
+    state_names = ['id','ad','st_h','st_w'] if meta['couple'] else ['id','ma','st']
+    if states:
+        select = state_names + [name for name in ('w',) if name in names] + select
+    table = pq.read_table(path,columns=select)
+
+    # states
+    if states:
+        out['states'] = np.transpose(np.vstack([table[s].to_numpy() for s in state_names[1:]]))
+        out['id'] = table['id'].to_numpy()
+        if 'w' in table.column_names:
+            out['w'] = table['w'].to_numpy()
+
+    # panels
+    for var in vars:
+        if meta['couple'] and var not in ('c','a','m','GovS'):
+            panel = []
+            for s in sex:
+                panel.append(to_panel(table,f'{var}_{s}_'))
+            out[var] = np.stack(panel,axis=2)
+        else:
+            out[var] = to_panel(table,f'{var}_')
+    out['meta'] = {key: val for key,val in meta.items() if key != 'stats'}
+
+    return out
+
+def to_panel(table,prefix):
+    """ stack the columns starting with prefix into a (agents, ages) float array """
+    names = [name for name in table.column_names if name.startswith(prefix) and name[len(prefix):].isdigit()]
+    if len(names) == 0:
+        return np.zeros((table.num_rows,0))
+    names = sorted(names,key=lambda name: int(name[len(prefix):]))
+    return np.column_stack([table[name].to_numpy(zero_copy_only=False).astype(float) for name in names])
+
+def stats(path):
+    """ per column statistics (null count, mean, min and max) of a parquet store """
+
+    # optional dependency
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    return json.loads(schema.metadata[b'sim'])['stats']
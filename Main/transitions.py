@@ -315,14 +315,15 @@ def precompute_inc_couple(par):
 
 @njit(parallel=True)
 def compute_inc_couple(par):
-    """ precompute income streams for couples """
+    """ precompute income streams for couples (parallel over t)
+
+    income only depends on ra of a retired spouse in the erp window, so each value is computed once
+    and copied to the ra's where it is the same """
 
     # states
     NAD = len(par.AD)
     NST = len(par.ST)
     NRA = 3
-    ND = 4
-    nd = 2 #int(ND/2)
 
     # shocks
     xi = par.xi    
@@ -338,99 +339,92 @@ def compute_inc_couple(par):
     inc_joint = par.inc_joint
     
     # precompute income
-    for t in range(T):
+    for t in prange(T):
         for adx in range(NAD):
+
+            # ages
+            ad = par.AD[adx]
+            t_h = t
+            t_w = t+ad
+
             for st_h in range(NST):
                 for st_w in range(NST):
+
+                    # a. pensions if both retired (for each ra)
+                    pre_h = np.zeros(NRA)
+                    pre_w = np.zeros(NRA)
+                    for ra in range(NRA):
+                        if t_h >= par.T_oap:
+                            pre_h[ra] = oap_pretax(t_h,par,i=1 if t_w < par.T_oap else 2)[0]
+                        elif par.T_erp <= t_h < par.T_oap:
+                            pre_h[ra] = erp_pretax(t_h,1,st_h,ra,par)[0]
+                        if t_w >= par.T_oap:
+                            pre_w[ra] = oap_pretax(t_w,par,i=1 if t_h < par.T_oap else 2)[0]
+                        elif par.T_erp <= t_w < par.T_oap:
+                            pre_w[ra] = erp_pretax(t_w,0,st_w,ra,par)[0]
+
+                    # b. both retired (all combinations of ra at once)
+                    pre_hh = np.repeat(pre_h,NRA)
+                    pre_ww = np.zeros(NRA*NRA)
                     for ra_h in range(NRA):
+                        pre_ww[ra_h*NRA:(ra_h+1)*NRA] = pre_w
+                    post_h = posttax(t_h,par,d=0,inc=pre_hh,inc_s=pre_ww,d_s=0,t_s=t_w)
+                    post_w = posttax(t_w,par,d=0,inc=pre_ww,inc_s=pre_hh,d_s=0,t_s=t_h)
+                    inc_pens[t,adx,st_h,st_w] = (post_h + post_w).reshape((NRA,NRA))
+
+                    # c. husband working (the same for all ra_h and for all ra_w outside the erp window)
+                    if t_h < par.Tr:
+                        lab_h = labor_pretax(t_h,1,st_h,par)*xi[1]
+                        erp_w = par.T_erp <= t_w < par.T_oap
                         for ra_w in range(NRA):
-                            for d_h in range(nd):
-                                for d_w in range(nd):
-
-                                    # ages
-                                    ad = par.AD[adx]
-                                    t_h = t
-                                    t_w = t+ad
-
-                                    # both retired
-                                    if d_h == 0 and d_w == 0:
-
-                                        # husband
-                                        pre_h = np.zeros(1)
-                                        if t_h >= par.T_oap:
-                                            if t_w < par.T_oap:
-                                                pre_h = oap_pretax(t_h,par,i=1)
-                                            else:
-                                                pre_h = oap_pretax(t_h,par,i=2)
-
-                                        elif par.T_erp <= t_h < par.T_oap:
-                                            pre_h = erp_pretax(t_h,1,st_h,ra_h,par)
-
-                                        # wife
-                                        pre_w = np.zeros(1)
-                                        if t_w >= par.T_oap:
-                                            if t_h < par.T_oap:
-                                                pre_w = oap_pretax(t_w,par,i=1)
-                                            else:
-                                                pre_w = oap_pretax(t_w,par,i=2)
-
-                                        elif par.T_erp <= t_w < par.T_oap:
-                                            pre_w = erp_pretax(t_w,0,st_w,ra_w,par)
-
-                                        # tax
-                                        post_h = posttax(t_h,par,d=d_h,inc=pre_h,inc_s=pre_w,d_s=d_w,t_s=t_w)
-                                        post_w = posttax(t_w,par,d=d_w,inc=pre_w,inc_s=pre_h,d_s=d_h,t_s=t_h)
-                                        inc_pens[t,adx,st_h,st_w,ra_h,ra_w] = post_h[0] + post_w[0]
-
-                                    # husband working
-                                    if d_h == 1 and d_w == 0:
-
-                                        # husband
-                                        if t_h < par.Tr:
-                                            pre_h = labor_pretax(t_h,1,st_h,par)*xi[1]
-
-                                            # wife
-                                            pre_w = np.zeros(pre_h.shape)
-                                            if t_w >= par.T_oap:
-                                                pre_w[:] = oap_pretax(t_w,par,i=1,y=pre_w,y_spouse=pre_h)
-                                            elif par.T_erp <= t_w < par.T_oap:
-                                                pre_w[:] = erp_pretax(t_w,0,st_w,ra_w,par)[0]
-
-                                            # tax                                        
-                                            post_h = posttax(t_h,par,d=d_h,inc=pre_h,inc_s=pre_w,d_s=d_w,t_s=t_w)
-                                            post_w = posttax(t_w,par,d=d_w,inc=pre_w,inc_s=pre_h,d_s=d_h,t_s=t_h)
-                                            inc_mixed[t,adx,st_h,st_w,ra_h,ra_w,d_h,d_w] = post_h + post_w
-
-                                    # wife working
-                                    if d_h == 0 and d_w == 1:
-
-                                        # wife
-                                        if t_w < par.Tr:
-                                            pre_w = labor_pretax(t_w,0,st_w,par)*xi[0]
-
-                                            # husband
-                                            pre_h = np.zeros(pre_w.shape)
-                                            if t_h >= par.T_oap:
-                                                pre_h[:] = oap_pretax(t_h,par,i=1,y=pre_h,y_spouse=pre_w)
-                                            elif par.T_erp <= t_h < par.T_oap:
-                                                pre_h[:] = erp_pretax(t_h,1,st_h,ra_h,par)[0]
-
-                                            # tax
-                                            post_w = posttax(t_w,par,d=d_w,inc=pre_w,inc_s=pre_h,d_s=d_h,t_s=t_h)
-                                            post_h = posttax(t_h,par,d=d_h,inc=pre_h,inc_s=pre_w,d_s=d_w,t_s=t_w)
-                                            inc_mixed[t,adx,st_h,st_w,ra_h,ra_w,d_h,d_w] = post_w + post_h
-
-                                    # both working                                    
-                                    if d_h == 1 and d_w == 1 and max(t_h,t_w) < par.Tr:
-
-                                        # labor market income
-                                        pre_w = labor_pretax(t_w,0,st_w,par)*xi_corr[0]
-                                        pre_h = labor_pretax(t_h,1,st_h,par)*xi_corr[1]
-
-                                        # tax
-                                        post_w = posttax(t_w,par,d=d_w,inc=pre_w,inc_s=pre_h,d_s=d_h,t_s=t_h)
-                                        post_h = posttax(t_h,par,d=d_h,inc=pre_h,inc_s=pre_w,d_s=d_w,t_s=t_w)
-                                        inc_joint[t,adx,st_h,st_w] = post_w + post_h
+                            if ra_w > 0 and (not erp_w or pre_w[ra_w] == pre_w[ra_w-1]):
+                                for ra_h in range(NRA):
+                                    inc_mixed[t,adx,st_h,st_w,ra_h,ra_w,1,0] = inc_mixed[t,adx,st_h,st_w,ra_h,ra_w-1,1,0]
+                                continue
+
+                            # wife
+                            pen_w = np.zeros(lab_h.shape)
+                            if t_w >= par.T_oap:
+                                pen_w[:] = oap_pretax(t_w,par,i=1,y=pen_w,y_spouse=lab_h)
+                            elif erp_w:
+                                pen_w[:] = pre_w[ra_w]
+
+                            # tax                                        
+                            post_h = posttax(t_h,par,d=1,inc=lab_h,inc_s=pen_w,d_s=0,t_s=t_w)
+                            post_w = posttax(t_w,par,d=0,inc=pen_w,inc_s=lab_h,d_s=1,t_s=t_h)
+                            for ra_h in range(NRA):
+                                inc_mixed[t,adx,st_h,st_w,ra_h,ra_w,1,0] = post_h + post_w
+
+                    # d. wife working (the same for all ra_w and for all ra_h outside the erp window)
+                    if t_w < par.Tr:
+                        lab_w = labor_pretax(t_w,0,st_w,par)*xi[0]
+                        erp_h = par.T_erp <= t_h < par.T_oap
+                        for ra_h in range(NRA):
+                            if ra_h > 0 and (not erp_h or pre_h[ra_h] == pre_h[ra_h-1]):
+                                for ra_w in range(NRA):
+                                    inc_mixed[t,adx,st_h,st_w,ra_h,ra_w,0,1] = inc_mixed[t,adx,st_h,st_w,ra_h-1,ra_w,0,1]
+                                continue
+
+                            # husband
+                            pen_h = np.zeros(lab_w.shape)
+                            if t_h >= par.T_oap:
+                                pen_h[:] = oap_pretax(t_h,par,i=1,y=pen_h,y_spouse=lab_w)
+                            elif erp_h:
+                                pen_h[:] = pre_h[ra_h]
+
+                            # tax
+                            post_w = posttax(t_w,par,d=1,inc=lab_w,inc_s=pen_h,d_s=0,t_s=t_h)
+                            post_h = posttax(t_h,par,d=0,inc=pen_h,inc_s=lab_w,d_s=1,t_s=t_w)
+                            for ra_w in range(NRA):
+                                inc_mixed[t,adx,st_h,st_w,ra_h,ra_w,0,1] = post_w + post_h
+
+                    # e. both working (does not depend on ra)
+                    if max(t_h,t_w) < par.Tr:
+                        lab_w = labor_pretax(t_w,0,st_w,par)*xi_corr[0]
+                        lab_h = labor_pretax(t_h,1,st_h,par)*xi_corr[1]
+                        post_w = posttax(t_w,par,d=1,inc=lab_w,inc_s=lab_h,d_s=1,t_s=t_h)
+                        post_h = posttax(t_h,par,d=1,inc=lab_h,inc_s=lab_w,d_s=1,t_s=t_w)
+                        inc_joint[t,adx,st_h,st_w] = post_w + post_h
 
 ##################################
 ####        tax system       #####